@@ -1,11 +1,167 @@
+import numpy as np
 import pandas as pd
 import networkx as nx
 import os
 import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from utils.graph_bundle import write_graph_bundle
+from utils.storage import add_format_arguments, read_table
+
+graph_columns = [
+    "base_year",
+    "professor_id",
+    "institution_abbr",
+    "degree_institution_abbr",
+    "is_international",
+    "field_id",
+    "field_name",
+    "big_field_id",
+    "big_field_name",
+]
+
+edge_columns = ["degree_institution_abbr", "institution_abbr", "field_id", "field_name", "big_field_id", "big_field_name"]
+big_field_columns = ["big_field_id", "big_field_name"]
+field_columns = ["field_id", "field_name", "big_field_id", "big_field_name"]
+professor_count_columns = ["year", "type", "n_prof", "big_field_id", "big_field_name", "field_id", "field_name"]
+
+default_windows = ["2004-2024", "2011-2020"]
+
+def parse_window(spec):
+    start_year, end_year = (int(year) for year in spec.split("-"))
+    if start_year > end_year:
+        raise argparse.ArgumentTypeError(f"invalid window: {spec}")
+    return start_year, end_year
+
+def parse_rolling(spec):
+    size, _, step = spec.partition(":")
+    size, step = int(size), int(step or 1)
+    if size < 1 or step < 1:
+        raise argparse.ArgumentTypeError(f"invalid rolling window: {spec}")
+    return size, step
+
+def rolling_windows(first_year, last_year, size, step):
+    return [(start_year, start_year + size - 1) for start_year in range(first_year, last_year - size + 2, step)]
+
+def appearance_index(df):
+    # rows are sorted once by (base_year, professor); every distinct (professor, year) pair keeps the
+    # previous and next year that professor appears in, so the first/last appearance of every professor
+    # in any window is read off the slice of pairs inside that window without grouping the rows again
+    years = df["base_year"].to_numpy()
+    professors, _ = pd.factorize(df["professor_id"])
+    row_order = np.lexsort((professors, years))
+    sorted_years, sorted_professors = years[row_order], professors[row_order]
+
+    new_pair = np.ones(len(row_order), dtype=bool)
+    new_pair[1:] = (sorted_years[1:] != sorted_years[:-1]) | (sorted_professors[1:] != sorted_professors[:-1])
+    pair_start = np.append(np.flatnonzero(new_pair), len(row_order))
+    pair_year = sorted_years[pair_start[:-1]].astype(float)
+    pair_professor = sorted_professors[pair_start[:-1]]
+
+    by_professor = np.lexsort((pair_year, pair_professor))
+    same_professor = pair_professor[by_professor][1:] == pair_professor[by_professor][:-1]
+    previous_year, next_year = np.full(len(pair_year), -np.inf), np.full(len(pair_year), np.inf)
+    previous_year[by_professor[1:][same_professor]] = pair_year[by_professor[:-1][same_professor]]
+    next_year[by_professor[:-1][same_professor]] = pair_year[by_professor[1:][same_professor]]
+    # rows without a professor id never count as anyone's first or last appearance
+    previous_year[pair_professor == -1], next_year[pair_professor == -1] = np.inf, -np.inf
+
+    return {
+        "row_order": row_order,
+        "row_year": sorted_years,
+        "pair_start": pair_start,
+        "pair_year": pair_year,
+        "previous_year": previous_year,
+        "next_year": next_year,
+    }
+
+def year_rows(index, year):
+    lo = np.searchsorted(index["row_year"], year, side="left")
+    hi = np.searchsorted(index["row_year"], year, side="right")
+    return np.sort(index["row_order"][lo:hi])
+
+def window_rows(index, start_year, end_year, appearance="last"):
+    lo = np.searchsorted(index["pair_year"], start_year, side="left")
+    hi = np.searchsorted(index["pair_year"], end_year, side="right")
+    if appearance == "last":
+        pairs = lo + np.flatnonzero(index["next_year"][lo:hi] > end_year)
+    else:
+        pairs = lo + np.flatnonzero(index["previous_year"][lo:hi] < start_year)
+    starts, lengths = index["pair_start"][pairs], np.diff(index["pair_start"])[pairs]
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return np.sort(index["row_order"][positions])
+
+def stack_periods(df, periods):
+    # periods is a list of (label, row positions); rows of every period are stacked once under an integer
+    # "period" column so that each aggregation below is a single groupby over all periods
+    positions = [rows for _, rows in periods]
+    stacked = df.iloc[np.concatenate(positions)]
+    return stacked.assign(period=np.repeat(np.arange(len(periods)), [len(p) for p in positions]))
+
+def aggregate_edges(stacked):
+    return stacked.groupby(["period"] + edge_columns + ["base_year"], observed=True).size().reset_index(name="weight")
+
+def aggregate_professor_counts(stacked, labels):
+    counts = pd.concat([
+        stacked.groupby("period")["professor_id"].nunique().reset_index(name="n_prof").assign(type="global"),
+        stacked.groupby(["period"] + big_field_columns, observed=True)["professor_id"].nunique().reset_index(name="n_prof").assign(type="big_field"),
+        stacked.groupby(["period"] + field_columns, observed=True)["professor_id"].nunique().reset_index(name="n_prof").assign(type="field"),
+    ], ignore_index=True)
+    # per period: the global count, then big fields, then fields, each sorted by its keys
+    counts = counts.sort_values("period", kind="stable")
+    counts["year"] = np.asarray(labels, dtype=object)[counts["period"].to_numpy()]
+    for column in ["big_field_id", "field_id"]:
+        counts[column] = counts[column].astype(float)
+    return counts[professor_count_columns].reset_index(drop=True)
+
+def build_graph(edges, edge_attr, country_list, state_dict, region_dict):
+    G = nx.from_pandas_edgelist(
+        edges,
+        source="degree_institution_abbr",
+        target="institution_abbr",
+        edge_attr=edge_attr,
+        create_using=nx.MultiDiGraph()
+    )
+    intl_flag = {n: (n in country_list) for n in G.nodes()}
+    nx.set_node_attributes(G, intl_flag, "international")
+    nx.set_node_attributes(G, state_dict, "state")
+    nx.set_node_attributes(G, region_dict, "region")
+    return G
+
+# read-only inputs shared by every graph; set once per worker process by init_graph_writer
+_graph_inputs = {}
+
+def init_graph_writer(edges, country_list, state_dict, region_dict):
+    _graph_inputs.update(
+        edges_by_period={period: period_edges for period, period_edges in edges.groupby("period")},
+        country_list=country_list,
+        state_dict=state_dict,
+        region_dict=region_dict,
+    )
+
+def write_period_graph(period, edge_attr, path):
+    period_edges = _graph_inputs["edges_by_period"][period]
+    G = build_graph(
+        period_edges,
+        edge_attr,
+        _graph_inputs["country_list"],
+        _graph_inputs["state_dict"],
+        _graph_inputs["region_dict"],
+    )
+    nx.write_graphml(G, f"{path}.graphml")
+    write_graph_bundle(f"{path}.bundle", period_edges, _graph_inputs["country_list"], _graph_inputs["state_dict"], _graph_inputs["region_dict"])
+    return path
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the hiring graphs from the institution-deduplicated table")
+    parser.add_argument("--windows", nargs="*", type=parse_window, default=[parse_window(spec) for spec in default_windows], metavar="START-END", help=f"time windows, as START-END years (default: {' '.join(default_windows)})")
+    parser.add_argument("--rolling", nargs="*", type=parse_rolling, default=[], metavar="SIZE[:STEP]", help="also build every SIZE-year window between the first and last year, moving STEP years at a time (default step: 1)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of graphs built and written in parallel (default: 1)")
+    add_format_arguments(parser, writes_output=False)
+    args = parser.parse_args()
+
     print("CONSTRUINDO GRAFOS")
-    df = pd.read_csv("processed/br-capes-colsucup-docente-deduped-institutions.csv", low_memory=False)
+    df = read_table("processed/br-capes-colsucup-docente-deduped-institutions", args.format, columns=graph_columns)
     print(f"    TAMANHO: {len(df)} LINHAS")
 
     print(f"    INSTITUIÇÕES DE GRAU: {len(df[df['degree_institution_abbr'].notna()])}")    
@@ -29,102 +185,48 @@ if __name__ == "__main__":
     br_institutions_state_dict = dict(zip(br_institutions_df["abbr"], br_institutions_df["state"]))
     br_institutions_region_dict = dict(zip(br_institutions_df["abbr"], br_institutions_df["region"]))
     
-    edges_by_year = {}
-    professors_by_year = []
-    for year, group in df.groupby("base_year"):
-        edges = group.groupby(["degree_institution_abbr", "institution_abbr", "field_id", "field_name", "big_field_id", "big_field_name"]).size().reset_index(name="weight")
-        edges_by_year[int(year)] = edges
-        n_prof_global = group["professor_id"].nunique()
-        professors_by_year.append({"year": f"{year}", "type": "global", "n_prof": int(n_prof_global), "big_field_id": None, "big_field_name": None, "field_id": None, "field_name": None})
-        n_prof_by_big_field = (
-            group
-            .groupby(["big_field_id", "big_field_name"])["professor_id"]
-            .nunique()
-            .reset_index(name="num_professors")
-        )
-        for big_field_id, big_field_name, n_prof in n_prof_by_big_field.values:
-            professors_by_year.append({"year": f"{year}", "type": "big_field", "big_field_id": int(big_field_id), "big_field_name": big_field_name, "n_prof": int(n_prof), "field_id": None, "field_name": None})
-        n_prof_by_field = (
-            group
-            .groupby(["field_id", "field_name", "big_field_id", "big_field_name"])["professor_id"]
-            .nunique()
-            .reset_index(name="num_professors")
-        )
-        for field_id, field_name, big_field_id, big_field_name, n_prof in n_prof_by_field.values:
-            professors_by_year.append({"year": f"{year}", "type": "field", "field_id": int(field_id), "field_name": field_name, "big_field_id": int(big_field_id), "big_field_name": big_field_name, "n_prof": int(n_prof)})
-    print(f"    ANOS: {sorted(edges_by_year.keys())}")
-    
-    graphs_by_year = {year: nx.from_pandas_edgelist(
-        edges,
-        source="degree_institution_abbr",
-        target="institution_abbr",
-        edge_attr=["weight", "field_id", "field_name", "big_field_id", "big_field_name"],
-        create_using=nx.MultiDiGraph()
-    ) for year, edges in edges_by_year.items()}
-    
-    for G in graphs_by_year.values():
-        intl_flag = {n: (n in country_list) for n in G.nodes()}
-        nx.set_node_attributes(G, intl_flag, "international")
-        nx.set_node_attributes(G, br_institutions_state_dict, "state")
-        nx.set_node_attributes(G, br_institutions_region_dict, "region")
-        nx.write_graphml(G, f"processed/graphs/all_fields/test/{year}.graphml")
-    time_windows = [(2004,2024), (2011,2020)]
-    print("    CONSTRUINDO GRAFOS POR JANELAS DE TEMPO")
-    time_window_field_graphs_count = 0
-    time_window_big_field_graphs_count = 0
-    for start_year, end_year in time_windows:
-        window_df = df[(df["base_year"] >= start_year) & (df["base_year"] <= end_year)]
-        max_year_per_prof = window_df.groupby("professor_id")["base_year"].transform("max")
-        min_year_per_prof = window_df.groupby("professor_id")["base_year"].transform("min")
-        min_df = window_df[window_df["base_year"] == min_year_per_prof]
-        window_df = window_df[window_df["base_year"] == max_year_per_prof]
-        edges = window_df.groupby(["degree_institution_abbr", "institution_abbr", "field_id", "field_name", "big_field_id", "big_field_name", "base_year"]).size().reset_index(name="weight")
-        min_edges = min_df.groupby(["degree_institution_abbr", "institution_abbr", "field_id", "field_name", "big_field_id", "big_field_name", "base_year"]).size().reset_index(name="weight")
-        min_G = nx.from_pandas_edgelist(
-            min_edges,
-            source="degree_institution_abbr",
-            target="institution_abbr",
-            edge_attr=["weight", "base_year", "field_id", "field_name", "big_field_id", "big_field_name"],
-            create_using=nx.MultiDiGraph()
-        )
-        intl_flag = {n: (n in country_list) for n in G.nodes()}
-        nx.set_node_attributes(G, intl_flag, "international")
-        nx.set_node_attributes(min_G, br_institutions_state_dict, "state")
-        nx.set_node_attributes(min_G, br_institutions_region_dict, "region")
-        nx.write_graphml(min_G, f"processed/graphs/all_fields/test/{start_year}-{end_year}-first-appearance.graphml")
-        G = nx.from_pandas_edgelist(
-            edges,
-            source="degree_institution_abbr",
-            target="institution_abbr",
-            edge_attr=["weight", "base_year", "field_id", "field_name", "big_field_id", "big_field_name"],
-            create_using=nx.MultiDiGraph()
-        )
-        intl_flag = {n: (n in country_list) for n in G.nodes()}
-        nx.set_node_attributes(G, intl_flag, "international")
-        nx.set_node_attributes(G, br_institutions_state_dict, "state")
-        nx.set_node_attributes(G, br_institutions_region_dict, "region")
-        nx.write_graphml(G, f"processed/graphs/all_fields/test/{start_year}-{end_year}.graphml")
-        
-        n_prof_global = window_df["professor_id"].nunique()
-        professors_by_year.append({"year": f"{start_year}-{end_year}", "type": "global", "n_prof": int(n_prof_global), "big_field_id": None, "big_field_name": None, "field_id": None, "field_name": None})
-        n_prof_by_big_field = (
-            window_df
-            .groupby(["big_field_id", "big_field_name"])["professor_id"]
-            .nunique()
-            .reset_index(name="num_professors")
-        )
-        for big_field_id, big_field_name, n_prof in n_prof_by_big_field.values:
-            professors_by_year.append({"year": f"{start_year}-{end_year}", "type": "big_field", "big_field_id": int(big_field_id), "big_field_name": big_field_name, "n_prof": int(n_prof), "field_id": None, "field_name": None})
-        n_prof_by_field = (
-            window_df
-            .groupby(["field_id", "field_name", "big_field_id", "big_field_name"])["professor_id"]
-            .nunique()
-            .reset_index(name="num_professors")
-        )
-        for field_id, field_name, big_field_id, big_field_name, n_prof in n_prof_by_field.values:
-            professors_by_year.append({"year": f"{start_year}-{end_year}", "type": "field", "field_id": int(field_id), "field_name": field_name, "big_field_id": int(big_field_id), "big_field_name": big_field_name, "n_prof": int(n_prof)})
-
-    professors_by_year_df = pd.DataFrame(professors_by_year)
+    years = sorted(df["base_year"].unique())
+    print(f"    ANOS: {[int(year) for year in years]}")
+    time_windows = list(dict.fromkeys(
+        args.windows + [window for size, step in args.rolling for window in rolling_windows(int(years[0]), int(years[-1]), size, step)]
+    ))
+    print(f"    JANELAS: {[f'{start_year}-{end_year}' for start_year, end_year in time_windows]}")
+
+    # every graph and every professor count is computed from one stacked frame: each year, then the
+    # last appearance of every professor in each window, then (graphs only) the first appearance
+    index = appearance_index(df)
+    periods = [(f"{year}", year_rows(index, year)) for year in years]
+    periods += [(f"{start_year}-{end_year}", window_rows(index, start_year, end_year, "last")) for start_year, end_year in time_windows]
+    first_appearance_periods = [
+        (f"{start_year}-{end_year}-first-appearance", window_rows(index, start_year, end_year, "first"))
+        for start_year, end_year in time_windows
+    ]
+    labels = [label for label, _ in periods + first_appearance_periods]
+
+    stacked = stack_periods(df, periods + first_appearance_periods)
+    edges = aggregate_edges(stacked)
+    professors_by_year_df = aggregate_professor_counts(stacked[stacked["period"] < len(periods)], labels)
+
+    print("    CONSTRUINDO GRAFOS POR ANO E POR JANELAS DE TEMPO")
+    graph_inputs = (edges, set(country_list), br_institutions_state_dict, br_institutions_region_dict)
+    tasks = []
+    for period in edges["period"].unique():
+        if period < len(years):
+            edge_attr = ["weight", "field_id", "field_name", "big_field_id", "big_field_name"]
+        else:
+            edge_attr = ["weight", "base_year", "field_id", "field_name", "big_field_id", "big_field_name"]
+        tasks.append((period, edge_attr, f"processed/graphs/all_fields/test/{labels[period]}"))
+
+    # each graph is written as GraphML and as a compact bundle (see utils.graph_bundle); graphs are built
+    # and serialized independently, so the files do not depend on --jobs
+    if args.jobs > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_graph_writer, initargs=graph_inputs) as executor:
+            list(executor.map(write_period_graph, *zip(*tasks)))
+    else:
+        init_graph_writer(*graph_inputs)
+        for task in tasks:
+            write_period_graph(*task)
+
     professors_by_year_df.to_csv("processed/professors_by_year.csv", index=False)
 
     print("CONSTRUÇÃO DE GRAFOS CONCLUÍDA")
@@ -1,8 +1,40 @@
+import argparse
+import numpy as np
 import pandas as pd
+from utils.storage import add_format_arguments, read_table, write_table
+
+def resolve_mapping(names, abbrs, mapping_lookup, abbr_vocabulary):
+    # resolve the mapped abbreviations once per distinct (name, abbr) pair: returns the pair code of
+    # every row, an integer abbreviation code per (pair, option) and the number of options per pair
+    pairs = pd.MultiIndex.from_arrays([names.astype(str), abbrs.astype(str)])
+    codes, unique_pairs = pd.factorize(pairs)
+    mapped = mapping_lookup.reindex(unique_pairs).to_numpy()
+    options = [split_mapped_abbr(value) for value in mapped]
+    counts = np.array([len(parts) for parts in options], dtype=np.int64)
+    option_codes = np.array([
+        -1 if part is None else abbr_vocabulary.setdefault(part, len(abbr_vocabulary))
+        for parts in options for part in parts
+    ], dtype=np.int64)
+    return codes, (option_codes, np.cumsum(counts) - counts), counts
+
+def split_mapped_abbr(value):
+    value = str(value)
+    if value == "nan":
+        return [None]
+    parts = [part.strip() for part in value.split("/")]
+    return [None if part in ("nan", "<NA>") else part for part in parts]
+
+def option_code(option_codes, pair_codes, option):
+    codes, offsets = option_codes
+    return codes[offsets[pair_codes] + option]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Map institutions of the professor-deduplicated table to canonical institutions")
+    add_format_arguments(parser)
+    args = parser.parse_args()
+
     print("DEDUPLICATING INSTITUTIONS")
-    df = pd.read_csv("processed/br-capes-colsucup-docente-professors-deduplicated.csv", sep=",", low_memory=False, encoding='utf-8')
+    df = read_table("processed/br-capes-colsucup-docente-professors-deduplicated", args.format)
     print(f"    SIZE: {len(df)} ROWS")
     
     unique_institutions_before = df[["institution_name", "institution_abbr"]].drop_duplicates().shape[0]
@@ -21,56 +53,67 @@ if __name__ == "__main__":
     )
     
     br_institutions_df_unique = br_institutions_df.drop_duplicates(subset=["abbr"], keep="first")
-    br_institutions_name_dict = br_institutions_df_unique.set_index("abbr")["name"].to_dict()
-    br_institutions_state_dict = br_institutions_df_unique.set_index("abbr")["state"].to_dict()
-    br_institutions_region_dict = br_institutions_df_unique.set_index("abbr")["region"].to_dict()
-    
-    df["_inst_key"] = df["institution_name"].astype(str) + "|" + df["institution_abbr"].astype(str)
-    df["_degree_key"] = df["degree_institution_name"].astype(str) + "|" + df["degree_institution_abbr"].astype(str)
-    
-    mapping_dict_str = {f"{k[0]}|{k[1]}": v for k, v in mapping_dict.items()}
-    df["institution_abbr_mapped"] = df["_inst_key"].map(mapping_dict_str)
-    df["degree_abbr_mapped"] = df["_degree_key"].map(mapping_dict_str)
-    df = df.drop(columns=["_inst_key", "_degree_key"])
-    
-    df["institution_abbr_mapped"] = df["institution_abbr_mapped"].astype(str).apply(
-        lambda x: x.split("/") if "/" in x and x != "nan" else ([x] if x != "nan" else [pd.NA])
-    )
-    df["degree_abbr_mapped"] = df["degree_abbr_mapped"].astype(str).apply(
-        lambda x: x.split("/") if "/" in x and x != "nan" else ([x] if x != "nan" else [pd.NA])
-    )
-    
+    mapping_lookup = pd.Series(mapping_dict, dtype=object)
+    mapping_lookup.index = pd.MultiIndex.from_arrays([
+        mapping_lookup.index.get_level_values(0).map(str),
+        mapping_lookup.index.get_level_values(1).map(str),
+    ])
+
+    abbr_vocabulary = {}
+    inst_codes, inst_option_codes, inst_option_counts = resolve_mapping(df["institution_name"], df["institution_abbr"], mapping_lookup, abbr_vocabulary)
+    degree_codes, degree_option_codes, degree_option_counts = resolve_mapping(df["degree_institution_name"], df["degree_institution_abbr"], mapping_lookup, abbr_vocabulary)
+    abbrs = pd.Series(list(abbr_vocabulary), dtype=object)
+
+    # rows whose institution or degree institution maps to several abbreviations are repeated, in the
+    # order DataFrame.explode would give; everything else is left in place
+    inst_counts = inst_option_counts[inst_codes]
+    degree_counts = degree_option_counts[degree_codes]
+    row_counts = inst_counts * degree_counts
     before_explode = len(df)
-    df = df.explode("institution_abbr_mapped", ignore_index=True)
-    df = df.explode("degree_abbr_mapped", ignore_index=True)
+    if (row_counts > 1).any():
+        rows = np.repeat(np.arange(len(df)), row_counts)
+        within_row = np.arange(len(rows)) - np.repeat(np.cumsum(row_counts) - row_counts, row_counts)
+        df = df.take(rows).reset_index(drop=True)
+        inst_option = within_row // degree_counts[rows]
+        degree_option = within_row % degree_counts[rows]
+        inst_codes, degree_codes = inst_codes[rows], degree_codes[rows]
+    else:
+        inst_option = degree_option = np.zeros(len(df), dtype=np.int64)
     print(f"    EXPLODED ROWS: {before_explode} -> {len(df)} ROWS")
-    
-    df["institution_abbr_mapped"] = df["institution_abbr_mapped"].astype(str).str.strip()
-    df["degree_abbr_mapped"] = df["degree_abbr_mapped"].astype(str).str.strip()
-    df["institution_abbr_mapped"] = df["institution_abbr_mapped"].replace("nan", pd.NA)
-    df["degree_abbr_mapped"] = df["degree_abbr_mapped"].replace("nan", pd.NA)
-    
+
+    inst_abbr_codes = option_code(inst_option_codes, inst_codes, inst_option)
+    degree_abbr_codes = option_code(degree_option_codes, degree_codes, degree_option)
+
+    invalid_codes = np.append(abbrs.str.lower().eq("invalid").to_numpy(dtype=bool), False)
+    keep = ~(invalid_codes[inst_abbr_codes] | invalid_codes[degree_abbr_codes])
     before_invalid_removal = len(df)
-    df = df[
-        (df["institution_abbr_mapped"].astype(str).str.lower() != "invalid") &
-        (df["degree_abbr_mapped"].astype(str).str.lower() != "invalid")
-    ]
+    df, inst_abbr_codes, degree_abbr_codes = df[keep], inst_abbr_codes[keep], degree_abbr_codes[keep]
     if before_invalid_removal > len(df):
         print(f"    REMOVED {before_invalid_removal - len(df)} ROWS WITH INVALID MAPPED_ABBR")
-    
-    df["institution_canonical_name"] = df["institution_abbr_mapped"].map(br_institutions_name_dict)
-    df["institution_state"] = df["institution_abbr_mapped"].map(br_institutions_state_dict)
-    df["institution_region"] = df["institution_abbr_mapped"].map(br_institutions_region_dict)
-    
-    df["degree_institution_canonical_name"] = df["degree_abbr_mapped"].map(br_institutions_name_dict)
-    df["degree_institution_state"] = df["degree_abbr_mapped"].map(br_institutions_state_dict)
-    df["degree_institution_region"] = df["degree_abbr_mapped"].map(br_institutions_region_dict)
-    
-    is_international = df["degree_institution_canonical_name"].isna()
-    df.loc[is_international, "degree_institution_canonical_name"] = df.loc[is_international, "degree_institution_country"]
-    df.loc[is_international, "degree_institution_state"] = df.loc[is_international, "degree_institution_country"]
-    df.loc[is_international, "degree_institution_region"] = df.loc[is_international, "degree_institution_country"]
-    df.loc[is_international, "degree_abbr_mapped"] = df.loc[is_international, "degree_institution_country"]
+
+    # one lookup table indexed by abbreviation code; its last row (code -1) is the missing abbreviation
+    lookup = (
+        br_institutions_df_unique.set_index("abbr")[["name", "state", "region"]]
+        .reindex(abbrs)
+        .reset_index(drop=True)
+    )
+    lookup.loc[len(lookup)] = np.nan
+    lookup["abbr"] = pd.concat([abbrs, pd.Series([pd.NA], dtype=object)], ignore_index=True)
+    institution = lookup.iloc[inst_abbr_codes].set_index(df.index)
+    degree_institution = lookup.iloc[degree_abbr_codes].set_index(df.index)
+
+    df["institution_abbr_mapped"] = institution["abbr"]
+    df["degree_abbr_mapped"] = degree_institution["abbr"]
+    df["institution_canonical_name"] = institution["name"]
+    df["institution_state"] = institution["state"]
+    df["institution_region"] = institution["region"]
+
+    is_international = degree_institution["name"].isna()
+    country = df["degree_institution_country"].astype(object)
+    df["degree_institution_canonical_name"] = degree_institution["name"].where(~is_international, country)
+    df["degree_institution_state"] = degree_institution["state"].where(~is_international, country)
+    df["degree_institution_region"] = degree_institution["region"].where(~is_international, country)
+    df["degree_abbr_mapped"] = df["degree_abbr_mapped"].where(~is_international, country)
     df["is_international"] = is_international
     
     df = df.drop(columns=["institution_name", "institution_abbr", "degree_institution_name", "degree_institution_abbr"])
@@ -79,7 +122,7 @@ if __name__ == "__main__":
     unique_institutions_after = df[["institution_abbr", "institution_canonical_name"]].drop_duplicates().shape[0]
     unique_degree_institutions_after = df[["degree_institution_abbr", "degree_institution_canonical_name"]].drop_duplicates().shape[0]
     
-    df.to_csv("processed/br-capes-colsucup-docente-deduped-institutions.csv", sep=",", index=False, encoding='utf-8')
+    write_table(df, "processed/br-capes-colsucup-docente-deduped-institutions", args.format, args.export_csv)
     print(f"\nTOTAL: {len(df)} ROWS")
     print(f"    UNIQUE INSTITUTIONS (after): {unique_institutions_after}")
     print(f"    UNIQUE DEGREE INSTITUTIONS (after): {unique_degree_institutions_after}")
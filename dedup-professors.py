@@ -1,98 +1,207 @@
+import argparse
+import itertools
+import os
+import time
+import numpy as np
 import pandas as pd
 import uuid
-from collections import defaultdict
-from utils.normalization import normalize_text
+from utils.normalization import normalize_series
+from utils.storage import add_format_arguments, read_table, write_table
+
+def union_find_merge(num_items, left, right):
+    # array-backed union-find over integer ids 0..num_items-1 with union by rank and iterative
+    # path compression; returns the root of every item
+    parent = list(range(num_items))
+    rank = [0] * num_items
 
-def union_find_merge(groups):
-    parent = {}
-    
     def find(x):
-        if x not in parent:
-            parent[x] = x
-        if parent[x] != x:
-            parent[x] = find(parent[x])
-        return parent[x]
-    
-    def union(x, y):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for x, y in zip(np.asarray(left).tolist(), np.asarray(right).tolist()):
         root_x = find(x)
         root_y = find(y)
-        if root_x != root_y:
-            parent[root_y] = root_x
-    
-    all_items = set()
-    for group in groups:
-        all_items.update(group)
-        if len(group) > 1:
-            items_list = list(group)
-            for i in range(1, len(items_list)):
-                union(items_list[0], items_list[i])
-    
-    result_groups = defaultdict(set)
-    for item in all_items:
-        root = find(item)
-        result_groups[root].add(item)
-    
-    return result_groups
+        if root_x == root_y:
+            continue
+        if rank[root_x] < rank[root_y]:
+            root_x, root_y = root_y, root_x
+        parent[root_y] = root_x
+        if rank[root_x] == rank[root_y]:
+            rank[root_x] += 1
+
+    # finish compressing every path at once by pointer jumping
+    roots = np.array(parent, dtype=np.int64)
+    while True:
+        next_roots = roots[roots]
+        if np.array_equal(next_roots, roots):
+            return roots
+        roots = next_roots
+
+def key_pairs(key_columns, valid):
+    # rows sharing a key are linked to the first row holding it; returns (key_rows, left, right)
+    # where key_rows holds the first row of every distinct key
+    rows = np.flatnonzero(valid.to_numpy())
+    if len(rows) == 0:
+        return rows, rows, rows
+    codes = key_columns[valid].groupby(list(key_columns.columns), sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = rows[np.unique(codes, return_index=True)[1]]
+    return first_rows, first_rows[codes], rows
+
+def fuzzy_pairs(blocks, values, valid, tolerance):
+    # blocking: only rows sharing every column of `blocks` are compared. Inside a block the distinct
+    # `values` are sorted and neighbours at most `tolerance` apart are linked (union-find makes the
+    # links transitive, so neighbours are enough); a missing value is linked only when the block has
+    # a single known value. Work is linear in the number of distinct (block, value) pairs.
+    rows = np.flatnonzero(valid.to_numpy())
+    empty = np.array([], dtype=np.int64)
+    if len(rows) == 0:
+        return empty, empty, {"blocks": 0, "largest_block": 0, "candidate_pairs": 0, "accepted_pairs": 0}
+    codes = blocks[valid].groupby(list(blocks.columns), sort=False, dropna=False).ngroup().to_numpy()
+    distinct = (
+        pd.DataFrame({"block": codes, "value": values.to_numpy()[rows], "row": rows})
+        .drop_duplicates(["block", "value"])
+    )
+    known = distinct[distinct["value"].notna()].sort_values(["block", "value"])
+    missing = distinct[distinct["value"].isna()]
+
+    same_block = known["block"].to_numpy()[1:] == known["block"].to_numpy()[:-1]
+    gaps = np.diff(known["value"].to_numpy(dtype=float))
+    accepted = same_block & (gaps <= tolerance)
+    known_rows = known["row"].to_numpy()
+    left = [known_rows[:-1][accepted]]
+    right = [known_rows[1:][accepted]]
+
+    known_per_block = known.groupby("block")["row"].agg(["first", "size"])
+    missing = missing.join(known_per_block, on="block", how="inner")
+    unambiguous = missing[missing["size"] == 1]
+    left.append(unambiguous["first"].to_numpy(dtype=np.int64))
+    right.append(unambiguous["row"].to_numpy(dtype=np.int64))
+
+    report = {
+        "blocks": int(codes.max()) + 1,
+        "largest_block": int(distinct.groupby("block").size().max()),
+        "candidate_pairs": int(same_block.sum()) + len(missing),
+        "accepted_pairs": int(accepted.sum()) + len(unambiguous),
+    }
+    return np.concatenate(left), np.concatenate(right), report
+
+professor_id_namespace = uuid.uuid5(uuid.NAMESPACE_URL, "br-capes-colsucup-docente/professor")
+professor_id_map_path = "processed/professor_ids.csv"
+
+def load_professor_id_map():
+    if not os.path.exists(professor_id_map_path):
+        return {}
+    id_map = pd.read_csv(professor_id_map_path, dtype=str, keep_default_na=False)
+    return dict(zip(id_map["key"], id_map["professor_id"]))
+
+def save_professor_id_map(id_map):
+    pd.DataFrame({"key": list(id_map), "professor_id": list(id_map.values())}).sort_values("key").to_csv(professor_id_map_path, index=False)
+
+def stable_professor_ids(keys, roots, id_map):
+    # one id per component: the id already mapped to its smallest previously seen key, otherwise a
+    # uuid5 of its smallest key, so ids survive reruns and components that grow with new years
+    keys = pd.DataFrame({"key": keys, "root": roots}).sort_values("key", kind="stable")
+    keys["mapped_id"] = keys["key"].map(id_map)
+    canonical = keys.groupby("root", sort=False)["key"].first()
+    ids = canonical.map(lambda key: str(uuid.uuid5(professor_id_namespace, key)))
+    mapped = keys.dropna(subset=["mapped_id"])
+    # when a mapped component has split, its id is claimed by every piece; it stays with the piece
+    # holding its smallest key, which is the first claim since the keys are sorted
+    owner = mapped.drop_duplicates("mapped_id").set_index("mapped_id")["root"]
+    owned = mapped[mapped["root"].to_numpy() == owner.reindex(mapped["mapped_id"]).to_numpy()]
+    ids.update(owned.groupby("root", sort=False)["mapped_id"].first())
+
+    # the other pieces get a uuid5 of their smallest key, or of their next key (then of a numbered
+    # variant) while that id is already held: the split id may come from the smallest key of a piece that lost it
+    split_roots = mapped["root"].drop_duplicates()
+    split_roots = split_roots[~split_roots.isin(owned["root"])]
+    taken = set(id_map.values()) | set(ids.drop(split_roots))
+    for root, root_keys in keys[keys["root"].isin(split_roots)].groupby("root", sort=False)["key"]:
+        for key in itertools.chain(root_keys, (f"{root_keys.iloc[0]}#split{n}" for n in itertools.count(1))):
+            professor_id = str(uuid.uuid5(professor_id_namespace, key))
+            if professor_id not in taken:
+                break
+        ids[root] = professor_id
+        taken.add(professor_id)
+    return keys["key"], ids.reindex(keys["root"]).to_numpy(), ids
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Assign a professor_id to every row of the pre-processed CAPES table")
+    parser.add_argument("--fuzzy", action="store_true", help="also merge records with the same name whose birth or degree years differ slightly or are missing")
+    parser.add_argument("--fuzzy-tolerance", type=int, default=1, help="largest year difference accepted by --fuzzy (default: 1)")
+    add_format_arguments(parser)
+    args = parser.parse_args()
+
     print("DEDUPLICATING PROFESSORS")
-    df = pd.read_csv("processed/br-capes-colsucup-docente.csv", sep=",", low_memory=False, encoding='utf-8')
+    df = read_table("processed/br-capes-colsucup-docente", args.format)
     print(f"    SIZE: {len(df)} ROWS")
     
-    df['index'] = df.index
-    
-    key1 = (
-        df['professor_name'].apply(normalize_text) + "|" + 
-        df['professor_document_number'].astype(str).str.strip()
+    normalized_name = normalize_series(df['professor_name'])
+    document_number = df['professor_document_number'].astype(str).str.strip()
+    birth_year = df['professor_birth_year'].astype(str).str.strip()
+    doctorate_year = df['professor_degree_year'].astype(str).str.strip()
+
+    # key1 is name|document, key2 is name|birth_year|degree_year; a key is usable when its name and
+    # its second field are present (a field holding "|" would have split into extra parts before)
+    name_valid = normalized_name.notna() & (normalized_name != "") & (normalized_name != "nan")
+    key1_valid = name_valid & (document_number != "") & (document_number != "nan") & ~document_number.str.contains("|", regex=False)
+    birth_year_head = birth_year.str.partition("|")[0]
+    key2_valid = name_valid & (birth_year_head != "") & (birth_year_head != "nan")
+
+    key1_rows, key1_left, key1_right = key_pairs(pd.DataFrame({"name": normalized_name, "document": document_number}), key1_valid)
+    key2_rows, key2_left, key2_right = key_pairs(pd.DataFrame({"name": normalized_name, "birth_year": birth_year, "degree_year": doctorate_year}), key2_valid)
+    print(f"    UNIQUE PROFESSORS (name+document): {len(key1_rows)}")
+    print(f"    UNIQUE PROFESSORS (name+birth+degree_year): {len(key2_rows)}")
+
+    left = [key1_left, key2_left]
+    right = [key1_right, key2_right]
+    if args.fuzzy:
+        # names are anonymized digests at this point, so they can only be blocked on exactly;
+        # the tolerance applies to the year fields, which carry the typos and gaps
+        numeric_birth_year = pd.to_numeric(df['professor_birth_year'], errors="coerce")
+        numeric_doctorate_year = pd.to_numeric(df['professor_degree_year'], errors="coerce")
+        fuzzy_passes = [
+            ("name+birth_year ~ degree_year", pd.DataFrame({"name": normalized_name, "birth_year": numeric_birth_year}), numeric_doctorate_year, name_valid & numeric_birth_year.notna()),
+            ("name+degree_year ~ birth_year", pd.DataFrame({"name": normalized_name, "degree_year": numeric_doctorate_year}), numeric_birth_year, name_valid & numeric_doctorate_year.notna()),
+        ]
+        for label, blocks, values, valid in fuzzy_passes:
+            start = time.perf_counter()
+            fuzzy_left, fuzzy_right, report = fuzzy_pairs(blocks, values, valid, args.fuzzy_tolerance)
+            left.append(fuzzy_left)
+            right.append(fuzzy_right)
+            print(f"    FUZZY {label.upper()}: {report['blocks']} BLOCKS (LARGEST {report['largest_block']}), "
+                  f"{report['candidate_pairs']} CANDIDATE PAIRS, {report['accepted_pairs']} ACCEPTED IN {time.perf_counter() - start:.2f}s")
+
+    roots = union_find_merge(len(df), np.concatenate(left), np.concatenate(right))
+    keyed = (key1_valid | key2_valid).to_numpy()
+    print(f"    UNIQUE PROFESSORS AFTER MERGE: {len(np.unique(roots[keyed]))}")
+
+    key1 = normalized_name.iloc[key1_rows] + "|" + document_number.iloc[key1_rows]
+    key2 = normalized_name.iloc[key2_rows] + "|" + birth_year.iloc[key2_rows] + "|" + doctorate_year.iloc[key2_rows]
+    # rows without any usable key stay singletons, keyed by their full content and its occurrence number
+    unkeyed_rows = np.flatnonzero(~keyed)
+    unkeyed_content = df.iloc[unkeyed_rows].astype(str).agg("|".join, axis=1) if len(unkeyed_rows) else pd.Series([], dtype=object)
+    unkeyed_key = "row|" + unkeyed_content + "#" + unkeyed_content.groupby(unkeyed_content).cumcount().astype(str)
+
+    id_map = load_professor_id_map()
+    keys, key_ids, root_ids = stable_professor_ids(
+        np.concatenate([key1.to_numpy(dtype=object), key2.to_numpy(dtype=object), unkeyed_key.to_numpy(dtype=object)]),
+        np.concatenate([roots[key1_rows], roots[key2_rows], roots[unkeyed_rows]]),
+        id_map,
     )
+    df['professor_id'] = root_ids.reindex(roots).to_numpy()
+    new_keys = int((~keys.isin(id_map.keys())).sum())
+    id_map.update(zip(keys, key_ids))
+    save_professor_id_map(id_map)
+    print(f"    PROFESSOR ID MAP: {len(id_map)} KEYS ({new_keys} NEW)")
     
-    name = df['professor_name'].apply(normalize_text).fillna('')
-    birth_year = df['professor_birth_year'].astype(str).str.strip().fillna('')
-    doctorate_year = df['professor_degree_year'].astype(str).str.strip().fillna('')
-    key2 = name + "|" + birth_year + "|" + doctorate_year
-    
-    key_to_indices = defaultdict(set)
-    key1_indices = defaultdict(set)
-    key2_indices = defaultdict(set)
-    
-    for idx, k1 in enumerate(key1):
-        if pd.notna(k1) and k1 and '|' in str(k1) and not str(k1).startswith('nan|'):
-            parts = str(k1).split('|')
-            if len(parts) == 2 and parts[0] and parts[1] and parts[1] != 'nan':
-                key_to_indices[k1].add(idx)
-                key1_indices[k1].add(idx)
-    
-    for idx, k2 in enumerate(key2):
-        if pd.notna(k2) and k2 and '|' in str(k2) and not str(k2).startswith('nan|'):
-            parts = str(k2).split('|')
-            if len(parts) >= 2 and parts[0] and parts[1] and parts[1] != 'nan':
-                key_to_indices[k2].add(idx)
-                key2_indices[k2].add(idx)
-    
-    unique_key1 = len([k for k, v in key1_indices.items() if len(v) > 0])
-    unique_key2 = len([k for k, v in key2_indices.items() if len(v) > 0])
-    print(f"    UNIQUE PROFESSORS (name+document): {unique_key1}")
-    print(f"    UNIQUE PROFESSORS (name+birth+degree_year): {unique_key2}")
-    
-    merged_groups = union_find_merge(key_to_indices.values())
-    print(f"    UNIQUE PROFESSORS AFTER MERGE: {len(merged_groups)}")
-    
-    professor_uuid_map = {}
-    for indices in merged_groups.values():
-        prof_uuid = uuid.uuid4()
-        for idx in indices:
-            professor_uuid_map[idx] = prof_uuid
-    
-    df['professor_id'] = df['index'].map(professor_uuid_map)
-    mask = df['professor_id'].isna()
-    unmatched_indices = df[mask]['index'].tolist()
-    for idx in unmatched_indices:
-        professor_uuid_map[idx] = uuid.uuid4()
-    df['professor_id'] = df['index'].map(professor_uuid_map)
-    
-    df = df.drop(columns=['index', 'professor_name', 'professor_document_number', 'professor_birth_year', 'professor_degree_year', 'professor_document_type'])
+    df = df.drop(columns=['professor_name', 'professor_document_number', 'professor_birth_year', 'professor_degree_year', 'professor_document_type'])
     unique_professors_final = df['professor_id'].nunique()
-    df.to_csv("processed/br-capes-colsucup-docente-professors-deduplicated.csv", sep=",", index=False, encoding='utf-8')
+    write_table(df, "processed/br-capes-colsucup-docente-professors-deduplicated", args.format, args.export_csv)
     print(f"\nTOTAL: {len(df)} ROWS")
     print(f"    UNIQUE PROFESSORS FINAL: {unique_professors_final}")
     print("DEDUPLICATION COMPLETED")
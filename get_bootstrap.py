@@ -0,0 +1,26 @@
+import os
+import argparse
+from utils.bootstrap import bootstrap_springrank, rank_quantiles
+from utils.graph_bundle import load_edges
+
+springrank_params = {"alpha": 0., "l0": 1., "l1": 1.}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals of the SpringRank positions")
+    parser.add_argument("--graph", default="data/BRCS_adjacency.dat", help="adjacency list written by get_data.py or a graph bundle written by build-graphs.py (default: data/BRCS_adjacency.dat)")
+    parser.add_argument("--replicates", type=int, default=1000, help="number of bootstrap replicates (default: 1000)")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the resampling (default: 42)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=50, help="replicates per task (default: 50)")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.025, 0.5, 0.975], help="quantiles of the scores and positions (default: 0.025 0.5 0.975)")
+    parser.add_argument("--output", help="CSV of the per-institution quantiles (default: the graph path with a -bootstrap.csv suffix)")
+    args = parser.parse_args()
+
+    nodes, sources, targets, weights = load_edges(args.graph)
+    observed, scores = bootstrap_springrank(sources, targets, weights, len(nodes), args.replicates, args.seed, args.jobs, args.chunk_size, springrank_params)
+    quantiles_df = rank_quantiles(nodes, observed, scores, args.quantiles).sort_values("rank")
+
+    output = args.output or os.path.splitext(args.graph.rstrip("/"))[0] + "-bootstrap.csv"
+    quantiles_df.rename_axis("institution_id").reset_index().to_csv(output, index=False)
+    print(f"Replicates: {len(scores)}")
+    print(quantiles_df.head(10).to_string())
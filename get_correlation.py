@@ -1,9 +1,36 @@
+import hashlib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy import stats
 
+# (frame content, method) -> (correlation, p-values), so plots of the same table share one computation
+_correlation_cache = {}
+
+def correlation_matrix(df, method='pearson'):
+    # r and two-sided p-values of every pair of columns, from pairwise complete observations; both
+    # p-values come from the t distribution with n - 2 degrees of freedom, as in stats.pearsonr and
+    # stats.spearmanr
+    key = (hashlib.sha256(pd.util.hash_pandas_object(df).to_numpy().tobytes() + str(list(df.columns)).encode()).hexdigest(), method)
+    if key not in _correlation_cache:
+        if method == 'spearman' and not df.isna().to_numpy().any():
+            # with no missing values every pair is complete, so ranking each column once gives the
+            # per-pair ranks; otherwise df.corr re-ranks the complete observations of each pair
+            correlation = df.rank().corr(method='pearson')
+        else:
+            correlation = df.corr(method=method)
+        present = df.notna().to_numpy(dtype=float)
+        n = present.T @ present
+        r = correlation.to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = r * np.sqrt((n - 2) / (1 - r ** 2))
+            p = 2 * stats.t.sf(np.abs(t), n - 2)
+        p[np.abs(r) == 1] = 0.
+        np.fill_diagonal(p, 0.)
+        _correlation_cache[key] = (correlation, pd.DataFrame(p, index=correlation.index, columns=correlation.columns))
+    return _correlation_cache[key]
+
 def plot_filtered_correlation(df, method='both', p_value_threshold=0.001, figsize=(14, 6)):
     valid_methods = ['pearson', 'spearman', 'both']
     if method not in valid_methods:
@@ -18,23 +45,7 @@ def plot_filtered_correlation(df, method='both', p_value_threshold=0.001, figsiz
         axes = [axes]
     
     for i, corr_method in enumerate(methods_to_use):
-        correlation = df.corr(method=corr_method)
-        
-        p_values = pd.DataFrame(np.zeros_like(correlation), 
-                              index=correlation.index, 
-                              columns=correlation.columns)
-        for i_idx in range(len(correlation.columns)):
-            for j_idx in range(len(correlation.columns)):
-                if i_idx != j_idx:
-                    x = df.iloc[:, i_idx].dropna()
-                    y = df.iloc[:, j_idx].dropna()
-                    
-                    if corr_method == 'pearson':
-                        corr_coef, p_value = stats.pearsonr(x, y)
-                    else: 
-                        corr_coef, p_value = stats.spearmanr(x, y)
-                        
-                    p_values.iloc[i_idx, j_idx] = p_value
+        correlation, p_values = correlation_matrix(df, corr_method)
         mask_p_value = p_values > p_value_threshold
         mask_upper = np.triu(np.ones_like(correlation, dtype=bool))
         combined_mask = np.logical_or(mask_upper, mask_p_value)
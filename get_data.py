@@ -3,29 +3,41 @@ import numpy as np
 import seaborn as sns
 import networkx as nx
 import os
+import argparse
 os.environ['MPLCONFIGDIR'] = "/scisci/prestige-hierarchy"
 from matplotlib import pyplot as plt
-import pyalex 
-
-def chunks(lst, n):
-    for i in range(0, len(lst), n):
-        yield lst[i:i + n]
+from utils.graph_bundle import factorize_endpoints
+from utils.openalex import InstitutionCache, fetch_institutions, http_fetcher
+from utils.ranking import rank_graph
 
 def getInternationalInstitutionsIds(ids):
-    international_ids = []
-    ids = chunks(ids, 100)
-    for chunk in ids:
-        id = '|'.join(chunk)
-        query = pyalex.Institutions() \
-            .filter(openalex=id).paginate(per_page=100)
-        for page in query:
-            for json in page:
-                if json["country_code"] != "BR":
-                    international_ids.append(json["id"].split("/")[3])
-
-    return international_ids
-
-pyalex.config.email = ""
+    # OpenAlex records are cached in processed/openalex.sqlite, so a rerun only fetches ids it has not seen
+    cache = InstitutionCache()
+    institutions = fetch_institutions(ids, http_fetcher(email=openalex_email), cache)
+    cache.close()
+    return [id for id, institution in institutions.items() if institution is not None and institution["country_code"] != "BR"]
+
+def institution_metrics(edges):
+    # in/out degree, in/out strength and self-hires of every institution of a (source, target, weight) edge
+    # table with one row per pair, plus the edge arrays the rankings are computed from
+    sources, targets, nodes = factorize_endpoints(edges['source'], edges['target'])
+    weights = edges['weight'].to_numpy()
+    num_nodes = len(nodes)
+    metrics_df = pd.DataFrame({
+        'institution_id': nodes,
+        'in_degree': np.bincount(targets, minlength=num_nodes),
+        'out_degree': np.bincount(sources, minlength=num_nodes),
+        'in_strength': np.bincount(targets, weights=weights, minlength=num_nodes).astype(weights.dtype),
+        'out_strength': np.bincount(sources, weights=weights, minlength=num_nodes).astype(weights.dtype),
+        'self_hires': np.bincount(targets[sources == targets], minlength=num_nodes),
+    })
+    return metrics_df, (list(nodes), sources, targets, weights)
+
+parser = argparse.ArgumentParser(description="Build the institution table of the hiring network")
+parser.add_argument("--no-graph", action="store_true", help="skip the networkx graph: its GraphML and adjacency list exports and the network plot")
+args = parser.parse_args()
+
+openalex_email = ""
 
 raw_df = pd.read_csv('data/authors.csv')
 df = raw_df.dropna(subset=['author_id', 'institution_id']).reset_index(drop=True)
@@ -67,56 +79,42 @@ print(institution_edges.info())
 print(institution_edges_br_only.info())
 print(institution_edges_international.info())
 
-# international_ids = getInternationalInstitutionsIds(institution_edges_international["source"])
+international_ids = getInternationalInstitutionsIds(institution_edges_international["source"])
 
-# institution_edges_international = institution_edges_international[institution_edges_international["source"].isin(international_ids)]
-# international_df = institution_edges_international.rename(columns={'target': 'institution_id'}).groupby(['institution_id'])['weight'].sum().reset_index(name='international_hires')
-# print(international_df.info())
-# print(international_df.head())
+institution_edges_international = institution_edges_international[institution_edges_international["source"].isin(international_ids)]
+international_df = institution_edges_international.rename(columns={'target': 'institution_id'}).groupby(['institution_id'])['weight'].sum().reset_index(name='international_hires')
+print(international_df.info())
+print(international_df.head())
 
 number = df[['phd_institution_id', 'institution_id']].rename(columns={'institution_id': 'target', 'phd_institution_id': 'source'})
 number = number[number['source'].isin(institution_df['institution_id'])]
 number.info()
 
-self_hires = institution_edges_br_only[institution_edges_br_only['source'] == institution_edges_br_only['target']]
-self_hires_edges = self_hires.groupby('target').size().reset_index(name='self_hires').rename(columns={"target": "institution_id"})
-G = nx.DiGraph()
-
-for index, row in institution_edges_br_only.iterrows():
-    G.add_edge(row['source'], row['target'], weight=row['weight'])
-
-print(G.number_of_nodes())
-print(G.number_of_edges())
-
-nx.write_graphml(G, "data/network.graphml")
-nx.write_adjlist(G, "data/network.dat")
-
-in_degree = [[node, val] for (node, val) in G.in_degree()]
-out_degree = [[node, val] for (node, val) in G.out_degree()]
-in_strength = [[node, val] for (node, val) in G.in_degree(weight='weight')]
-out_strength = [[node, val] for (node, val) in G.out_degree(weight='weight')]
-
-degree_df = pd.DataFrame(in_degree, columns=['institution_id', 'in_degree'])
-print(degree_df.head())
-degree_df = degree_df.merge(pd.DataFrame(out_degree, columns=['institution_id', 'out_degree']))
-degree_df = degree_df.merge(pd.DataFrame(in_strength, columns=['institution_id', 'in_strength']))
-degree_df = degree_df.merge(pd.DataFrame(out_strength, columns=['institution_id', 'out_strength']))
-
-institution_df = institution_df.merge(degree_df)
-# pagerank_df = pd.DataFrame.from_dict(nx.pagerank(G), orient='index', columns=['page_rank']).reset_index().rename(columns={'index': 'institution_id'})
-# institution_df = institution_df.merge(pagerank_df)
-new_spring_rank_df = pd.read_csv('data/new_ranking_df.csv')
-institution_df = institution_df.merge(new_spring_rank_df)
-institution_df = institution_df.merge(self_hires_edges, how="left").fillna(0)
+metrics_df, edge_arrays = institution_metrics(institution_edges_br_only)
+print(len(metrics_df))
+print(len(institution_edges_br_only))
+print(metrics_df.head())
+
+if not args.no_graph:
+    G = nx.from_pandas_edgelist(institution_edges_br_only, source='source', target='target', edge_attr='weight', create_using=nx.DiGraph)
+    nx.write_graphml(G, "data/network.graphml")
+    nx.write_adjlist(G, "data/network.dat")
+
+institution_df = institution_df.merge(metrics_df)
+# SpringRank, PageRank and minimum violation ranking of the network, memoized by graph content in processed/rankings/cache
+ranking_df = rank_graph(edge_arrays).rename(columns={'springrank': 'new_spring_rank', 'pagerank': 'page_rank', 'mvr': 'mvr_rank'})
+ranking_df['new_shifted_spring_rank'] = ranking_df['new_spring_rank'] - ranking_df['new_spring_rank'].min()
+institution_df = institution_df.merge(ranking_df.rename_axis('institution_id').reset_index())
 institution_df = institution_df.merge(international_df, how="left").fillna(0)
 institution_df.info()
 
-plt.figure(figsize=(10, 8))
-pos = nx.spring_layout(G)
-nx.draw(G, pos, with_labels=True, node_color='skyblue', node_size=1500, 
-        edge_color='gray', linewidths=1, font_size=15)
-plt.show()
-plt.savefig("figures/plot.pdf")
+if not args.no_graph:
+    plt.figure(figsize=(10, 8))
+    pos = nx.spring_layout(G)
+    nx.draw(G, pos, with_labels=True, node_color='skyblue', node_size=1500, 
+            edge_color='gray', linewidths=1, font_size=15)
+    plt.show()
+    plt.savefig("figures/plot.pdf")
 
 np.savetxt(r'data/BRCS_adjacency.dat', institution_edges_br_only.values, fmt='%s %s %d')
 
@@ -2,13 +2,19 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 os.environ['MPLCONFIGDIR'] = "/scisci/prestige-hierarchy"
 import matplotlib.pyplot as plt
-from SpringRank import SpringRank
-import tools as tl
-import random
 from tqdm import tqdm
 from scipy.stats import ttest_ind
+from utils.graph_bundle import edge_arrays, load_edges
+from utils.hierarchy import graph_hierarchy_strength, hierarchy_strength, hierarchy_strength_batch
+from utils.null_models import configuration_model_edges, iteration_rng
+from utils.ranking import graph_adjacency, graph_hash
+from utils.sequential import STOPPING_RULES, clopper_pearson, stopping_rule
+from utils.springrank import jacobi_preconditioner, laplacian_system, springrank, springrank_batch
 
 import seaborn as sns
 sns.set_theme(style="white")
@@ -18,30 +24,18 @@ def generate_random_network(din, dout):
 
     return rewired_G
 
-def calculate_rank(G):
-    alpha=0.
-    l0=1.
-    l1=1.
+springrank_params = {"alpha": 0., "l0": 1., "l1": 1.}
 
-    nodes = list(G.nodes())
-    A = nx.to_scipy_sparse_matrix(G, dtype=float,nodelist=nodes)
-    rank = SpringRank(A, alpha=alpha, l0=l0, l1=l1)
-    rank = tl.shift_rank(rank)
+def calculate_rank(G, x0=None):
+    nodes, sources, targets, weights = edge_arrays(G)
+    rank = springrank(sources, targets, weights, len(nodes), x0=x0, **springrank_params)
     rank = {nodes[i]:rank[i] for i in range(G.number_of_nodes())}
     return rank
 
-def calculate_hierarchy_strength(G):
-    total_edges = G.number_of_edges()
-    if total_edges == 0:
-        return 0
-    rank = calculate_rank(G)
-    hierarchy_edges = 0
-    total = 0
-    for u, v, d in G.edges(data=True):
-        total += d['weight']
-        if rank[u] < rank[v]:
-            hierarchy_edges += d['weight']
-    return hierarchy_edges / total
+def calculate_hierarchy_strength(G, rank=None):
+    if rank is None:
+        rank = calculate_rank(G)
+    return graph_hierarchy_strength(G, rank)
 
 def calculate_p_value_two_sided(observed_strength, random_strengths):
     count = sum(1 for s in random_strengths if s <= observed_strength)
@@ -56,48 +50,188 @@ def plot_monte_carlo_results(original_strength, rewired_strengths, plot):
   
     p_value = calculate_p_value_two_sided(original_strength, rewired_strengths)
     
-    plot.xlabel('Hierarchy Strength')
-    plot.ylabel('Frequency')
+    plot.set_xlabel('Hierarchy Strength')
+    plot.set_ylabel('Frequency')
     plot.legend()
     plot.grid(True)
     
     return p_value
 
-def monte_carlo_configuration_model(G, num_iterations=1000):
-    din = list(d for _, d in G.in_degree())
-    dout = list(d for _, d in G.out_degree())
-
-    weights = [d['weight'] for _, _, d in G.edges(data=True)]
-    random.shuffle(weights)
-    original_rank = calculate_hierarchy_strength(G)
-    null_ranks = []
-    for _ in tqdm(range(num_iterations)):
-        try:
-            G_null = nx.directed_configuration_model(din, dout)
-            for i, (_, _, d) in zip(range(0, G_null.number_of_edges()), G_null.edges(data=True)):
-                d['weight'] = weights[i]
-            random.shuffle(weights)
-            mapping = {i: node for i, node in enumerate(G.nodes())}
-            G_null = nx.relabel_nodes(G_null, mapping)
-            null_rank = calculate_hierarchy_strength(G_null)
-            null_ranks.append(null_rank)
-        except:
-            continue
-    
-    return original_rank, null_ranks
-   
+# read-only inputs of the null draws; set once per worker process by init_null_worker
+_null_inputs = {}
+
+def init_null_worker(sources, targets, weights, num_nodes, seed):
+    observed_rank = springrank(sources, targets, weights, num_nodes, **springrank_params)
+    # every null graph has the node set and degrees of G, so they all share the preconditioner of the
+    # observed graph and start from the observed ranking
+    preconditioner = jacobi_preconditioner(laplacian_system(sources, targets, weights, num_nodes, **springrank_params)[0])
+    _null_inputs.update(
+        dout=np.bincount(sources, minlength=num_nodes),
+        din=np.bincount(targets, minlength=num_nodes),
+        weights=weights,
+        num_nodes=num_nodes,
+        seed=seed,
+        observed_rank=observed_rank,
+        preconditioner=preconditioner,
+    )
+
+def null_strengths(iterations):
+    strengths = np.full(len(iterations), np.nan)
+    null_edges = [
+        configuration_model_edges(_null_inputs["dout"], _null_inputs["din"], _null_inputs["weights"], iteration_rng(_null_inputs["seed"], iteration))
+        for iteration in iterations
+    ]
+    # failed draws rank as None and are kept as NaN, so they are counted and not retried on resume
+    null_node_ranks = list(springrank_batch(
+        null_edges, _null_inputs["num_nodes"], x0=_null_inputs["observed_rank"], preconditioner=_null_inputs["preconditioner"], skip_failed=True, **springrank_params
+    ))
+
+    # every null graph has as many edges as G, so the chunk is scored as one (draws, edges) batch
+    drawn = [i for i, rank in enumerate(null_node_ranks) if rank is not None]
+    if drawn:
+        null_sources, null_targets, null_weights = (np.stack(arrays) for arrays in zip(*(null_edges[i] for i in drawn)))
+        strengths[drawn] = hierarchy_strength_batch(np.stack([null_node_ranks[i] for i in drawn]), null_sources, null_targets, null_weights)
+    return list(zip(iterations, strengths.tolist()))
+
+def checkpoint_metadata_path(path):
+    return f"{path}.json"
+
+def load_checkpoint(path, metadata):
+    # a checkpoint only resumes the run that wrote it: same graph content, seed and SpringRank parameters
+    if path is None or not os.path.exists(path):
+        return {}
+    saved = None
+    if os.path.exists(checkpoint_metadata_path(path)):
+        with open(checkpoint_metadata_path(path)) as f:
+            saved = json.load(f)
+    if saved != metadata:
+        raise ValueError(f"Checkpoint {path} was not written for this graph, seed and SpringRank parameters; remove it or choose another --checkpoint")
+    checkpoint = pd.read_csv(path, float_precision="round_trip")
+    return dict(zip(checkpoint["iteration"], checkpoint["strength"]))
+
+def save_checkpoint_metadata(path, metadata):
+    with open(checkpoint_metadata_path(path), "w") as f:
+        json.dump(metadata, f, sort_keys=True)
+
+def append_checkpoint(path, results):
+    pd.DataFrame(results, columns=["iteration", "strength"]).to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+
+def monte_carlo_configuration_model(nodes, sources, targets, weights, num_iterations=1000, seed=42, jobs=1, checkpoint=None, chunk_size=50, stop=None):
+    # iteration i always draws from the i-th child of SeedSequence(seed), so the strengths do not depend
+    # on --jobs or on how often the run was resumed from its checkpoint. With a stopping rule (see
+    # utils.sequential) num_iterations is the budget, and the rule is checked after every draw in
+    # iteration order, so the stopping point does not depend on --jobs or --chunk-size either
+    null_inputs = (sources, targets, weights, len(nodes), seed)
+    init_null_worker(*null_inputs)
+    original_rank = hierarchy_strength(_null_inputs["observed_rank"], sources, targets, weights)
+
+    metadata = {"graph": graph_hash(*graph_adjacency((nodes, sources, targets, weights))), "seed": seed, "springrank_params": springrank_params}
+    strengths = {iteration: strength for iteration, strength in load_checkpoint(checkpoint, metadata).items() if iteration < num_iterations}
+    if checkpoint is not None and not os.path.exists(checkpoint):
+        save_checkpoint_metadata(checkpoint, metadata)
+    pending = [iteration for iteration in range(num_iterations) if iteration not in strengths]
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+
+    # draws scanned so far, in iteration order
+    scan = {"next": 0, "extremes": 0, "draws": 0, "total": 0., "stopped": False}
+    def advance():
+        while not scan["stopped"] and scan["next"] in strengths:
+            strength = strengths[scan["next"]]
+            scan["next"] += 1
+            if not np.isnan(strength):
+                scan["draws"] += 1
+                scan["total"] += strength
+                scan["extremes"] += int(strength <= original_rank)
+            if stop is not None and stop(scan["extremes"], scan["draws"]):
+                scan["stopped"] = True
+
+    progress = tqdm(total=num_iterations, initial=len(strengths))
+    def record(results):
+        strengths.update(results)
+        if checkpoint is not None:
+            append_checkpoint(checkpoint, results)
+        advance()
+        if scan["draws"]:
+            progress.set_postfix(mean=f"{scan['total'] / scan['draws']:.4f}", p=f"{scan['extremes'] / scan['draws']:.4f}")
+        progress.update(len(results))
+
+    advance()
+    if not scan["stopped"]:
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_null_worker, initargs=null_inputs)
+            try:
+                for results in executor.map(null_strengths, chunks):
+                    record(results)
+                    if scan["stopped"]:
+                        break
+            finally:
+                executor.shutdown(cancel_futures=True)
+        else:
+            for chunk in chunks:
+                record(null_strengths(chunk))
+                if scan["stopped"]:
+                    break
+    progress.close()
+
+    ordered = [strengths[iteration] for iteration in range(scan["next"])]
+    null_ranks = [strength for strength in ordered if not np.isnan(strength)]
+    return original_rank, null_ranks, len(ordered) - len(null_ranks)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo test of the hierarchy strength against configuration-model null graphs")
+    parser.add_argument("--graph", nargs="+", default=["data/BRCS_adjacency.dat"], help="graphs to test: adjacency lists written by get_data.py, or graph bundles or GraphML files written by build-graphs.py (default: data/BRCS_adjacency.dat)")
+    parser.add_argument("--iterations", type=int, default=10, help="number of null graphs, or the most that are drawn with an adaptive --stopping rule (default: 10)")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the null draws (default: 42)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes (default: 1)")
+    parser.add_argument("--chunk-size", type=int, default=50, help="null graphs per task and per checkpoint write (default: 50)")
+    parser.add_argument("--checkpoint", help="CSV of per-iteration strengths, or with several --graph a directory of one such CSV per graph; completed iterations found there are skipped, so an interrupted run resumes where it stopped; the graph hash, seed and SpringRank parameters are kept next to it in a .json file, and a checkpoint of another run is refused")
+    parser.add_argument("--stopping", choices=STOPPING_RULES, default="fixed", help="fixed: draw every iteration; besag-clifford: stop after --extremes null strengths at or below the observed one; confidence: stop once the p-value interval is on one side of --threshold or narrower than --precision (default: fixed)")
+    parser.add_argument("--extremes", type=int, default=10, help="extreme draws that stop besag-clifford (default: 10)")
+    parser.add_argument("--threshold", type=float, default=0.05, help="significance threshold of the confidence rule (default: 0.05)")
+    parser.add_argument("--confidence", type=float, default=0.99, help="confidence of the reported p-value interval (default: 0.99)")
+    parser.add_argument("--precision", type=float, help="width of the p-value interval that also stops the confidence rule")
+    parser.add_argument("--summary", help="CSV with one row of results per graph")
+    args = parser.parse_args()
 
-np.random.seed(42)
-G = tl.build_graph_from_adjacency("data/BRCS_adjacency.dat")
-fig, ax = plt.subplots(1, 2, figsize=(10, 4))
+    stop = stopping_rule(args.stopping, args.extremes, args.threshold, args.confidence, args.precision)
+    if args.checkpoint is not None and len(args.graph) > 1:
+        os.makedirs(args.checkpoint, exist_ok=True)
+    summary = []
+    for graph in args.graph:
+        # the figure is written next to the graph, so the year and field graphs do not overwrite each other
+        stem = os.path.splitext(graph.rstrip("/"))[0]
+        checkpoint = args.checkpoint
+        if checkpoint is not None and len(args.graph) > 1:
+            checkpoint = os.path.join(checkpoint, stem.strip("/").replace("/", "_") + ".csv")
 
-original_rank, null_ranks = monte_carlo_configuration_model(G, 10)
-p_value = plot_monte_carlo_results(original_rank, null_ranks, ax[0])
-print(f"Original hierarchy strength: {original_rank:.4f}")
-print(f"Mean rewired hierarchy strength: {np.mean(null_ranks):.4f}")
-print(f"p-value: {p_value:.10f}")
+        print(f"\nGraph: {graph}")
+        nodes, sources, targets, weights = load_edges(graph)
+        original_rank, null_ranks, failed_draws = monte_carlo_configuration_model(nodes, sources, targets, weights, args.iterations, args.seed, args.jobs, checkpoint, args.chunk_size, stop)
+        if failed_draws:
+            print(f"Failed null draws: {failed_draws}")
+        fig, ax = plt.subplots(1, 2, figsize=(10, 4))
+        p_value = plot_monte_carlo_results(original_rank, null_ranks, ax[0])
+        extremes = sum(1 for strength in null_ranks if strength <= original_rank)
+        p_lower, p_upper = clopper_pearson(extremes, len(null_ranks), args.confidence)
+        print(f"Iterations used: {len(null_ranks) + failed_draws} of {args.iterations}")
+        print(f"Original hierarchy strength: {original_rank:.4f}")
+        print(f"Mean rewired hierarchy strength: {np.mean(null_ranks):.4f}")
+        print(f"p-value: {p_value:.10f}")
+        print(f"p-value {args.confidence:.0%} interval: [{p_lower:.6f}, {p_upper:.6f}]")
 
-plt.tight_layout()
-plt.show()
-plt.savefig("figures/montecarlo.pdf")
+        plt.tight_layout()
+        plt.savefig(f"{stem}-montecarlo.pdf")
+        plt.close(fig)
+        summary.append({
+            "graph": graph,
+            "strength": original_rank,
+            "null_mean": np.mean(null_ranks),
+            "p_value": p_value,
+            "p_lower": p_lower,
+            "p_upper": p_upper,
+            "draws": len(null_ranks),
+            "failed_draws": failed_draws,
+        })
 
+    if args.summary is not None:
+        pd.DataFrame(summary).to_csv(args.summary, index=False)
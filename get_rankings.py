@@ -0,0 +1,24 @@
+import os
+import glob
+import argparse
+from utils.graph_bundle import load_graph_bundle
+from utils.ranking import RANKERS, rank_graph, ranking_cache_directory
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the institutions of every graph written by build-graphs.py")
+    parser.add_argument("--graphs", default="processed/graphs/all_fields/test", help="directory with the graph bundles (default: processed/graphs/all_fields/test)")
+    parser.add_argument("--output", default="processed/rankings", help="directory of the ranking tables, one CSV per graph (default: processed/rankings)")
+    parser.add_argument("--rankers", nargs="+", choices=list(RANKERS), default=list(RANKERS), help="rankings to compute (default: all)")
+    args = parser.parse_args()
+
+    print("CALCULANDO RANKINGS")
+    os.makedirs(args.output, exist_ok=True)
+    for path in sorted(glob.glob(os.path.join(args.graphs, "*.bundle"))):
+        label = os.path.basename(path)[:-len(".bundle")]
+        bundle = load_graph_bundle(path)
+        rankings = rank_graph(bundle, args.rankers, cache_directory=ranking_cache_directory)
+        rankings = rankings.join(bundle.nodes.set_index("name")[["state", "region", "international"]])
+        rankings.rename_axis("institution_abbr").reset_index().to_csv(os.path.join(args.output, f"{label}.csv"), index=False)
+        print(f"    {label}: {len(rankings)} INSTITUIÇÕES")
+
+    print("RANKINGS CONCLUÍDOS")
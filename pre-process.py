@@ -1,11 +1,36 @@
 import os
+import argparse
 import glob
+import shutil
 import re
 import math
+import numpy as np
 import pandas as pd
-from utils.normalization import normalize_text
+from utils.normalization import normalize_series
+from utils.storage import add_format_arguments, write_table
 import json
 import hashlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+invalid_patterns = [
+    r"^invalid$",
+    r"^[A-Za-z]$",
+    r"^(.)\1{1,}$",
+    r"^\d$",
+    r"^\d+$",
+    r"^nao informado$",
+    r"^nao informada$",
+    r"^instituicao nao cadastrada$",
+    r"^nao consta$",
+    r"^outra$",
+    r"^outro$",
+    r"^ni$"
+]
+
+invalid_patterns_regex = re.compile("|".join(invalid_patterns))
+non_alphanumeric_regex = re.compile(r"[^a-z0-9]+")
 
 def is_valid(x):
     if x is None:
@@ -17,31 +42,21 @@ def is_valid(x):
     if not isinstance(x, str):
         return False
 
-    invalid_patterns = [
-        r"^invalid$",
-        r"^[A-Za-z]$",
-        r"^(.)\1{1,}$",
-        r"^\d$",
-        r"^\d+$",
-        r"^nao informado$",
-        r"^nao informada$",
-        r"^instituicao nao cadastrada$",
-        r"^nao consta$",
-        r"^outra$",
-        r"^outro$",
-        r"^ni$"
-    ]
-
-    invalid_patterns_regex = "|".join(invalid_patterns)
-
     if x == "" or x == "nan":
         return False
-    if re.search(invalid_patterns_regex, x):
+    if invalid_patterns_regex.search(x):
         return False
-    if re.fullmatch(r"[^a-z0-9]+", x):
+    if non_alphanumeric_regex.fullmatch(x):
         return False
     return True
 
+def valid_mask(series):
+    # evaluate is_valid once per distinct value and broadcast back; missing values get code -1,
+    # which indexes the trailing False
+    codes, uniques = pd.factorize(series)
+    valid = np.fromiter((is_valid(x) for x in uniques), dtype=bool, count=len(uniques))
+    return pd.Series(np.append(valid, False)[codes], index=series.index)
+
 capes_columns_mapping = {
     "AN_BASE": "base_year",
     "NM_ENTIDADE_ENSINO": "institution_name",
@@ -77,10 +92,32 @@ capes_columns_mapping = {
     "DS_CATEGORIA_DOCENTE": "employee_type"
 }
 
+# identifiers and years whose dtype read_csv infers from the values: a column with gaps is float, so
+# str(value), which is hashed by the anonymization and compared by the dedup keys, gives "1970.0"
+capes_inferred_columns = [
+    "NR_DOCUMENTO_DOCENTE",
+    "AN_NASCIMENTO_DOCENTE",
+    "AN_TITULACAO",
+    "AN_TITULACAO_DOCENTE",
+    "CD_CONCEITO_PROGRAMA",
+]
+
 fields_mapping = {int(k): v for k, v in json.load(open("processed/manual/fields_mapping.json")).items()}
 
+anonymization_salt = "br-capes-colsucup-docente"
+
 def anonymize_value(value):
-    return hashlib.sha256(("br-capes-colsucup-docente" + str(value)).encode()).hexdigest()
+    return hashlib.sha256((anonymization_salt + str(value)).encode()).hexdigest()
+
+# professors recur in every year they are active, so digests are kept for the whole run
+_anonymize_text_cached = lru_cache(maxsize=2 ** 20)(anonymize_value)
+
+def anonymize_series(series):
+    # anonymize_value hashes str(value), so hashing the distinct strings gives identical digests;
+    # pandas >= 3 keeps missing values missing through astype(str), so code -1 indexes the digest of "nan"
+    codes, uniques = pd.factorize(series.astype(str))
+    digests = np.array([_anonymize_text_cached(value) for value in uniques] + [_anonymize_text_cached(str(np.nan))], dtype=object)
+    return pd.Series(digests[codes], index=series.index, name=series.name, dtype=object)
 
 def report_removed_rows(df, func, text):
     before = len(df)
@@ -90,90 +127,291 @@ def report_removed_rows(df, func, text):
     return df
 
 def remove_invalid_rows(df):
-    df = df[df.apply(lambda row: is_valid(row["degree_institution_name"]) or is_valid(row["degree_institution_abbr"]), axis=1)]
+    df = df[valid_mask(df["degree_institution_name"]) | valid_mask(df["degree_institution_abbr"])]
     return df
 
 def normalize_columns(df):
     for column in df.columns:
         if column in ["institution_name", "institution_abbr", "degree_institution_name", "degree_institution_abbr", "degree_institution_country", "program_name"]:
-            df[column] = df[column].apply(normalize_text)
+            df[column] = normalize_series(df[column])
     print("    NORMALIZATION COMPLETED")
     return df
 
-def process_data_files(data_files):
-    dfs = []
-    total_rows = 0
-    total_removed_rows = {
+def empty_removed_rows():
+    return {
         "NON-ACADEMIC PROGRAMS": 0,
         "NON-DOCTORAL DEGREES": 0,
         "INVALID": 0,
     }
-    for data_file in data_files:
-        print("\nPROCESSING FILE: ", data_file)
+
+def by_year_path(year):
+    return f"processed/by_year/br-capes-colsucup-docente-{year}.csv"
+
+def write_by_year(df):
+    for year, df_year in df.groupby("base_year"):
+        df_year.to_csv(by_year_path(year), index=False, encoding="utf-8", sep=',')
+        print(f"    SAVED {year} CSV FILE")
+
+def process_frame(df, removed_rows):
+    # special case for 2004-2012 capes data
+    if 'CD_CONCEITO_PROGRAMA' not in df.columns:
+        df['CD_CONCEITO_PROGRAMA'] = "nao consta"
+        df['NR_DOCUMENTO_DOCENTE'] = "nao consta"
+        df['TP_DOCUMENTO_DOCENTE'] = "nao consta"
+
+    # dict.fromkeys keeps the column order stable across runs and worker processes, unlike set()
+    df = df.rename(columns=capes_columns_mapping)[list(dict.fromkeys(capes_columns_mapping.values()))]
+    present_rows = len(df)
+    df = report_removed_rows(df, lambda df: df[df["program_type"] == "ACADÊMICO"], "NON-ACADEMIC PROGRAMS")
+    removed_rows["NON-ACADEMIC PROGRAMS"] += present_rows - len(df)
+    present_rows = len(df)
+
+    df = report_removed_rows(df, lambda df: df[df["degree_level"].str.contains("DOUTOR", case=False, na=False)], "NON-DOCTORAL DEGREES")
+    removed_rows["NON-DOCTORAL DEGREES"] += present_rows - len(df)
+    present_rows = len(df)
+
+    df["has_masters"] = df["program_degree"].str.contains("MESTRADO", case=False, na=False)
+    df["has_doctors"] = df["program_degree"].str.contains("DOUTORADO", case=False, na=False)
+    df["has_professional_degree"] = df["program_degree"].str.contains("PROFISSIONAL", case=False, na=False)
+    df = df[~df["has_professional_degree"]]
+    df.drop(columns=["program_type", "program_degree", "degree_level"], inplace=True)
+
+    df = normalize_columns(df)
+
+    df = report_removed_rows(df, remove_invalid_rows, "INVALID")
+    removed_rows["INVALID"] += present_rows - len(df)
+    for col in ["institution_name", "institution_abbr", "degree_institution_name", "degree_institution_abbr", "degree_institution_country", "program_name"]:
+        if col in df.columns:
+            df[col] = df[col].where(valid_mask(df[col]), "invalid")
+
+    fields = (
+        df["field_id"]
+        .map(fields_mapping)
+        .apply(pd.Series)
+    )
+    # a chunk may be empty or hold only unmapped fields; keep all three columns either way
+    df[["field_name", "big_field_id", "big_field_name"]] = pd.DataFrame(fields, index=df.index).reindex(columns=range(3))
+
+    df["professor_name"] = anonymize_series(df["professor_name"])
+    df["professor_document_number"] = anonymize_series(df["professor_document_number"])
+
+    return df
+
+def part_directory(data_file):
+    return f"processed/parts/{os.path.splitext(os.path.basename(data_file))[0]}"
+
+def append_csv(df, path):
+    df.to_csv(path, mode="a", header=not os.path.exists(path), index=False, encoding="utf-8", sep=',')
+
+def file_summary(years, total_rows, kept_rows, removed_rows):
+    return {
+        "years": sorted(str(year) for year in years),
+        "total_rows": int(total_rows),
+        "kept_rows": int(kept_rows),
+        "removed_rows": removed_rows,
+    }
+
+def whole_file_dtypes(data_file, chunksize):
+    # the dtypes read_csv infers for capes_inferred_columns when it reads the whole file, found chunk by
+    # chunk: a column is float when any chunk has a gap and text when any chunk has a non-number, so
+    # every chunk gives the same strings as the in-memory path
+    dtypes = {}
+    for chunk in pd.read_csv(data_file, encoding="latin1", sep=";", low_memory=False, usecols=lambda column: column in capes_inferred_columns, chunksize=chunksize):
+        for column, dtype in chunk.dtypes.items():
+            dtypes[column] = np.result_type(dtypes.get(column, dtype), dtype)
+    return dtypes
+
+def process_data_file(data_file, chunksize=None):
+    removed_rows = empty_removed_rows()
+    print("\nPROCESSING FILE: ", data_file)
+    if chunksize is None:
         df = pd.read_csv(data_file, encoding="latin1", sep=";", low_memory=False)
         print(f"    SIZE: {len(df)} ROWS")
+        total_rows = len(df)
+        df = process_frame(df, removed_rows)
+        write_by_year(df)
+        return df, file_summary(df["base_year"].unique(), total_rows, len(df), removed_rows)
 
-        # special case for 2004-2012 capes data
-        if 'CD_CONCEITO_PROGRAMA' not in df.columns:
-            df['CD_CONCEITO_PROGRAMA'] = "nao consta"
-            df['NR_DOCUMENTO_DOCENTE'] = "nao consta"
-            df['TP_DOCUMENTO_DOCENTE'] = "nao consta"
-
-        df = df.rename(columns=capes_columns_mapping)[list(set(capes_columns_mapping.values()))]
-        present_rows = len(df)
-        total_rows += present_rows
-        df = report_removed_rows(df, lambda df: df[df["program_type"] == "ACADÊMICO"], "NON-ACADEMIC PROGRAMS")
-        total_removed_rows["NON-ACADEMIC PROGRAMS"] += present_rows - len(df)
-        present_rows = len(df)
-
-        df = report_removed_rows(df, lambda df: df[df["degree_level"].str.contains("DOUTOR", case=False, na=False)], "NON-DOCTORAL DEGREES")
-        total_removed_rows["NON-DOCTORAL DEGREES"] += present_rows - len(df)
-        present_rows = len(df)
-
-        df["has_masters"] = df["program_degree"].str.contains("MESTRADO", case=False, na=False)
-        df["has_doctors"] = df["program_degree"].str.contains("DOUTORADO", case=False, na=False)
-        df["has_professional_degree"] = df["program_degree"].str.contains("PROFISSIONAL", case=False, na=False)
-        df = df[~df["has_professional_degree"]]
-        df.drop(columns=["program_type", "program_degree", "degree_level"], inplace=True)
-
-        df = normalize_columns(df)
-
-        df = report_removed_rows(df, remove_invalid_rows, "INVALID")
-        total_removed_rows["INVALID"] += present_rows - len(df)
-        for col in ["institution_name", "institution_abbr", "degree_institution_name", "degree_institution_abbr", "degree_institution_country", "program_name"]:
-            if col in df.columns:
-                df[col] = df[col].map(lambda x: "invalid" if not is_valid(x) else x)
-        
-        df[["field_name", "big_field_id", "big_field_name"]] = (
-            df["field_id"]
-            .map(fields_mapping)
-            .apply(pd.Series)
-        )
-        
-        df["professor_name"] = df["professor_name"].map(anonymize_value)
-        df["professor_document_number"] = df["professor_document_number"].map(anonymize_value)
-        
-        os.makedirs("processed", exist_ok=True)
-        os.makedirs("processed/by_year", exist_ok=True)
+    # streaming mode: only one chunk is held in memory; processed rows are appended to per-file
+    # parts that process_data_files moves into place once every file is done
+    part_dir = part_directory(data_file)
+    shutil.rmtree(part_dir, ignore_errors=True)
+    os.makedirs(part_dir)
+    total_rows = 0
+    kept_rows = 0
+    years = set()
+    dtypes = whole_file_dtypes(data_file, chunksize)
+    for chunk in pd.read_csv(data_file, encoding="latin1", sep=";", low_memory=False, dtype=dtypes, chunksize=chunksize):
+        print(f"    CHUNK: {len(chunk)} ROWS")
+        total_rows += len(chunk)
+        chunk = process_frame(chunk, removed_rows)
+        kept_rows += len(chunk)
+        append_csv(chunk, f"{part_dir}/combined.csv")
+        for year, chunk_year in chunk.groupby("base_year"):
+            append_csv(chunk_year, f"{part_dir}/{year}.csv")
+            years.add(year)
+    print(f"    SIZE: {total_rows} ROWS")
+    return None, file_summary(years, total_rows, kept_rows, removed_rows)
 
-        dfs.append(df)
-        for year, df_year in df.groupby("base_year"):
-            df_year.to_csv(f"processed/by_year/br-capes-colsucup-docente-{year}.csv", index=False, encoding="utf-8", sep=',')
-            print(f"    SAVED {year} CSV FILE")
+def load_cached_file(data_file, summary, chunksize=None):
+    print("\nREUSING CACHED FILE: ", data_file)
+    if chunksize is None:
+        df = pd.concat([pd.read_csv(by_year_path(year), low_memory=False, encoding="utf-8") for year in summary["years"]], ignore_index=True)
+        return df, summary
+
+    # give merge_parts the same per-file parts a streaming run would have written
+    part_dir = part_directory(data_file)
+    shutil.rmtree(part_dir, ignore_errors=True)
+    os.makedirs(part_dir)
+    for year in summary["years"]:
+        shutil.copyfile(by_year_path(year), f"{part_dir}/{year}.csv")
+        with open(by_year_path(year), encoding="utf-8") as year_file, open(f"{part_dir}/combined.csv", "a", encoding="utf-8") as combined:
+            header = year_file.readline()
+            if combined.tell() == 0:
+                combined.write(header)
+            shutil.copyfileobj(year_file, combined)
+    return None, summary
+
+def merge_parts(data_files):
+    # as in the in-memory path, a year found in several files is taken from the last of them
+    year_parts = {}
+    for data_file in data_files:
+        for path in sorted(glob.glob(f"{part_directory(data_file)}/*.csv")):
+            year = os.path.splitext(os.path.basename(path))[0]
+            if year != "combined":
+                year_parts[year] = path
+    for year, path in year_parts.items():
+        os.replace(path, by_year_path(year))
+        print(f"    SAVED {year} CSV FILE")
+
+    with open("processed/br-capes-colsucup-docente.csv", "w", encoding="utf-8") as output:
+        header_written = False
+        for data_file in data_files:
+            path = f"{part_directory(data_file)}/combined.csv"
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as part:
+                header = part.readline()
+                if not header_written:
+                    output.write(header)
+                    header_written = True
+                shutil.copyfileobj(part, output)
+    shutil.rmtree("processed/parts")
+
+manifest_path = "processed/manifest.json"
+
+def config_fingerprint():
+    config = {
+        "capes_columns_mapping": capes_columns_mapping,
+        "fields_mapping": fields_mapping,
+        "invalid_patterns": invalid_patterns,
+        "anonymization_salt": anonymization_salt,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest():
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)["files"]
 
-    df = pd.concat(dfs, ignore_index=True)
+def save_manifest(entries):
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"files": entries}, f, indent=2, sort_keys=True)
+
+def find_cached_files(data_files, hashes, config):
+    # a file is reused only when its content and the config are unchanged, its by_year outputs are
+    # still on disk and no other file wrote to the same years (which would have overwritten them)
+    manifest = load_manifest()
+    cached = {}
+    for data_file in data_files:
+        entry = manifest.get(data_file)
+        if entry is None or entry["sha256"] != hashes[data_file] or entry["config"] != config:
+            continue
+        other_years = {year for other, other_entry in manifest.items() if other != data_file for year in other_entry["years"]}
+        if other_years & set(entry["years"]):
+            continue
+        if all(os.path.exists(by_year_path(year)) for year in entry["years"]):
+            cached[data_file] = file_summary(entry["years"], entry["total_rows"], entry["kept_rows"], entry["removed_rows"])
+    return cached
+
+def process_data_files(data_files, workers=1, table_format="csv", export_csv=False, chunksize=None, incremental=False):
+    os.makedirs("processed", exist_ok=True)
+    os.makedirs("processed/by_year", exist_ok=True)
+
+    config = config_fingerprint()
+    hashes = {data_file: file_sha256(data_file) for data_file in data_files}
+    cached = find_cached_files(data_files, hashes, config) if incremental else {}
+    stale_files = [data_file for data_file in data_files if data_file not in cached]
+    print(f"\nFILES TO PROCESS: {len(stale_files)} (CACHED: {len(cached)})")
+
+    # cached outputs are loaded before anything is processed, since a changed file may overwrite their years
+    results = {data_file: load_cached_file(data_file, cached[data_file], chunksize) for data_file in data_files if data_file in cached}
+    process = partial(process_data_file, chunksize=chunksize)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results.update(zip(stale_files, executor.map(process, stale_files)))
+    else:
+        results.update((data_file, process(data_file)) for data_file in stale_files)
+    results = [results[data_file] for data_file in data_files]
+
+    dfs = []
+    total_rows = 0
+    kept_rows = 0
+    total_removed_rows = empty_removed_rows()
+    for df, summary in results:
+        dfs.append(df)
+        total_rows += summary["total_rows"]
+        kept_rows += summary["kept_rows"]
+        for reason, count in summary["removed_rows"].items():
+            total_removed_rows[reason] += count
 
     print(f"TOTAL ROWS: {total_rows}")
     print(f"TOTAL REMOVED ROWS: {total_removed_rows}")
 
-    df.to_csv("processed/br-capes-colsucup-docente.csv", index=False, encoding="utf-8", sep=',')
-    print(f"\nTOTAL: {len(df)} ROWS")
+    if chunksize is not None:
+        merge_parts(data_files)
+        print(f"\nTOTAL: {kept_rows} ROWS")
+    else:
+        # a year present in several files may have been written concurrently or out of order; rewrite
+        # it from the last of those files, which is what a serial run leaves on disk
+        files_per_year = Counter(year for df in dfs for year in df["base_year"].unique())
+        last_df_by_year = {year: df for df in dfs for year in df["base_year"].unique()}
+        for year, count in files_per_year.items():
+            if count > 1:
+                write_by_year(last_df_by_year[year][last_df_by_year[year]["base_year"] == year])
+
+        df = pd.concat(dfs, ignore_index=True)
+
+        write_table(df, "processed/br-capes-colsucup-docente", table_format, export_csv)
+        print(f"\nTOTAL: {len(df)} ROWS")
+
+    save_manifest({
+        data_file: {"sha256": hashes[data_file], "config": config, **summary}
+        for data_file, (_, summary) in zip(data_files, results)
+    })
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-process the yearly CAPES docente files in data/")
+    parser.add_argument("--workers", type=int, default=1, help="number of files processed in parallel (default: 1)")
+    parser.add_argument("--chunksize", type=int, default=None, help="stream each file in chunks of this many rows to bound memory use (CSV output only)")
+    parser.add_argument("--incremental", action="store_true", help=f"reuse the by_year outputs of files whose content and configuration match {manifest_path}")
+    add_format_arguments(parser)
+    args = parser.parse_args()
+    if args.chunksize is not None and args.format != "csv":
+        parser.error("--chunksize writes its output incrementally and only supports --format csv")
+
     print("PRE-PROCESSING CAPES DATA")
 
     data_files = list(glob.glob('data/*.{}'.format('csv')))
     data_files.sort()
-    process_data_files(data_files)
+    process_data_files(data_files, workers=args.workers, table_format=args.format, export_csv=args.export_csv, chunksize=args.chunksize, incremental=args.incremental)
 
-    print("PRE-PROCESSING COMPLETED")
\ No newline at end of file
+    print("PRE-PROCESSING COMPLETED")
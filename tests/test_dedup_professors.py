@@ -0,0 +1,36 @@
+import importlib.util
+import os
+import uuid
+import numpy as np
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("dedup_professors", os.path.join(repo_root, "dedup-professors.py"))
+dedup_professors = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(dedup_professors)
+
+def key_id(key):
+    return str(uuid.uuid5(dedup_professors.professor_id_namespace, key))
+
+def assign(keys, roots, id_map):
+    keys, key_ids, root_ids = dedup_professors.stable_professor_ids(np.array(keys, dtype=object), np.array(roots), id_map)
+    return dict(zip(keys, key_ids)), root_ids
+
+def test_ids_survive_reruns_and_growth():
+    first, _ = assign(["b", "a"], [0, 0], {})
+    assert set(first.values()) == {key_id("a")}
+    grown, _ = assign(["a", "b", "0"], [5, 5, 5], first)
+    assert set(grown.values()) == {key_id("a")}
+
+def test_split_component_gets_one_id_per_piece():
+    id_map, _ = assign(["a", "b", "c"], [0, 0, 0], {})
+    split, root_ids = assign(["a", "b", "c"], [0, 1, 2], id_map)
+    assert root_ids.nunique() == 3
+    assert split == {"a": key_id("a"), "b": key_id("b"), "c": key_id("c")}
+
+def test_split_piece_does_not_reuse_the_id_derived_from_its_key():
+    # the id was derived from "b" before "a" joined the component; "a" holds the smallest key and keeps it
+    id_map = {"a": key_id("b"), "b": key_id("b")}
+    split, root_ids = assign(["a", "b"], [0, 1], id_map)
+    assert root_ids.nunique() == 2
+    assert split["a"] == key_id("b")
+    assert split["b"] not in id_map.values()
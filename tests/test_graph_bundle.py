@@ -0,0 +1,66 @@
+import os
+import sys
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.graph_bundle import load_edges, load_graph_bundle, write_graph_bundle
+
+def edges():
+    return pd.DataFrame({
+        "degree_institution_abbr": ["usp", "mit", "usp", "ufmg", "usp"],
+        "institution_abbr": ["ufmg", "usp", "ufmg", "usp", "unicamp"],
+        "weight": [1., 2., 1., 3., 1.],
+        "field_id": [1, 1, 2, 2, 1],
+        "field_name": ["computacao", "computacao", "fisica", "fisica", "computacao"],
+        "big_field_id": [10, 10, 10, 10, 10],
+        "big_field_name": ["exatas"] * 5,
+        "base_year": [2013, 2014, 2014, 2015, 2015],
+    })
+
+def test_bundle_round_trip(tmp_path):
+    path = str(tmp_path / "graph.bundle")
+    write_graph_bundle(path, edges(), ["mit"], {"usp": "SP", "ufmg": "MG", "unicamp": "SP"}, {"usp": "SE", "ufmg": "SE", "unicamp": "SE"})
+    bundle = load_graph_bundle(path)
+
+    assert bundle.nodes["name"].tolist() == ["usp", "ufmg", "mit", "unicamp"]
+    assert bundle.nodes["international"].tolist() == [False, False, True, False]
+    assert bundle.nodes["state"].tolist()[:2] == ["SP", "MG"] and pd.isna(bundle.nodes["state"][2])
+    expected = np.zeros((4, 4))
+    for source, target, weight in [(0, 1, 1.), (2, 0, 2.), (0, 1, 1.), (1, 0, 3.), (0, 3, 1.)]:
+        expected[source, target] += weight
+    np.testing.assert_array_equal(bundle.adjacency.toarray(), expected)
+    assert bundle.adjacency.nnz == 5
+    assert bundle.fields == {1: "computacao", 2: "fisica"}
+
+def test_bundle_adjacency_stays_memory_mapped(tmp_path):
+    path = str(tmp_path / "graph.bundle")
+    write_graph_bundle(path, edges(), [], {}, {})
+    A = load_graph_bundle(path).adjacency
+    for name, values in [("indptr", A.indptr), ("indices", A.indices), ("data", A.data)]:
+        while not isinstance(values, np.memmap) and values.base is not None:
+            values = values.base
+        assert isinstance(values, np.memmap), name
+
+def weight_table(nodes, sources, targets, weights):
+    return pd.DataFrame({"source": np.asarray(nodes)[sources], "target": np.asarray(nodes)[targets], "weight": weights}).groupby(["source", "target"])["weight"].sum()
+
+def test_load_edges_reads_bundles_graphml_and_adjacency_lists(tmp_path):
+    bundle_path = str(tmp_path / "graph.bundle")
+    write_graph_bundle(bundle_path, edges(), [], {}, {})
+    adjacency_path = str(tmp_path / "adjacency.dat")
+    table = edges().groupby(["degree_institution_abbr", "institution_abbr"])["weight"].sum()
+    with open(adjacency_path, "w") as f:
+        f.writelines(f"{source} {target} {weight}\n" for (source, target), weight in table.items())
+
+    graphml_path = str(tmp_path / "graph.graphml")
+    nx.write_graphml(nx.from_pandas_edgelist(edges(), "degree_institution_abbr", "institution_abbr", ["weight"], create_using=nx.MultiDiGraph), graphml_path)
+
+    from_bundle = load_edges(bundle_path)
+    from_list = load_edges(adjacency_path)
+    from_graphml = load_edges(graphml_path)
+    assert from_bundle[0] == from_graphml[0] == ["usp", "ufmg", "mit", "unicamp"]
+    pd.testing.assert_series_equal(weight_table(*from_bundle), weight_table(*from_list))
+    pd.testing.assert_series_equal(weight_table(*from_bundle), weight_table(*from_graphml))
+    pd.testing.assert_series_equal(weight_table(*from_bundle), table.rename_axis(["source", "target"]))
@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# get_monte_carlo.py plots with matplotlib and seaborn and reports progress with tqdm
+for module in ["matplotlib", "seaborn", "tqdm"]:
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import get_monte_carlo
+
+def random_graph(seed=0, num_nodes=25, num_edges=150):
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, num_nodes, num_edges)
+    targets = rng.integers(0, num_nodes, num_edges)
+    return [f"i{i}" for i in range(num_nodes)], sources, targets, rng.integers(1, 4, num_edges).astype(float)
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path):
+    graph = random_graph()
+    _, expected, _ = get_monte_carlo.monte_carlo_configuration_model(*graph, num_iterations=12, seed=3, chunk_size=4)
+    checkpoint = str(tmp_path / "checkpoint.csv")
+    get_monte_carlo.monte_carlo_configuration_model(*graph, num_iterations=5, seed=3, checkpoint=checkpoint, chunk_size=4)
+    _, resumed, _ = get_monte_carlo.monte_carlo_configuration_model(*graph, num_iterations=12, seed=3, checkpoint=checkpoint, chunk_size=4)
+    assert resumed == expected
+
+@pytest.mark.parametrize("change", ["graph", "seed", "springrank_params", "metadata_missing"])
+def test_checkpoint_of_another_run_is_refused(tmp_path, monkeypatch, change):
+    graph = random_graph()
+    checkpoint = str(tmp_path / "checkpoint.csv")
+    get_monte_carlo.monte_carlo_configuration_model(*graph, num_iterations=4, seed=3, checkpoint=checkpoint)
+    seed = 3
+    if change == "graph":
+        graph = random_graph(seed=1)
+    elif change == "seed":
+        seed = 4
+    elif change == "springrank_params":
+        monkeypatch.setattr(get_monte_carlo, "springrank_params", {"alpha": 1., "l0": 1., "l1": 1.})
+    else:
+        os.remove(get_monte_carlo.checkpoint_metadata_path(checkpoint))
+    with pytest.raises(ValueError):
+        get_monte_carlo.monte_carlo_configuration_model(*graph, num_iterations=8, seed=seed, checkpoint=checkpoint)
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.normalization import normalize_series, normalize_text
+
+# strings with accents, case, punctuation and spacing, missing values, and values of different types
+# that compare equal (2, 2.0 and True, 1) but are written differently
+mixed_values = [
+    "Universidade de São Paulo", "UNIVERSIDADE DE SAO PAULO", "  puc-rio ", "U.F.M.G.", "", "nan",
+    None, np.nan, 2, 2.0, np.int64(2), 1, True, 1.0, "1", False, 0, 1.5,
+]
+
+@pytest.mark.parametrize("values", [
+    mixed_values,
+    [value for value in mixed_values if isinstance(value, str) or value is None or value is np.nan],
+    [],
+])
+def test_normalize_series_matches_apply(values):
+    series = pd.Series(values * 2, index=np.arange(2 * len(values))[::-1], dtype=object, name="institution_name")
+    expected = series.apply(normalize_text).astype(object) if len(series) else series.copy()
+    pd.testing.assert_series_equal(normalize_series(series), expected)
+
+@pytest.mark.parametrize("values", [[1.5, np.nan, 2.0], ["a", None, "b"]])
+def test_normalize_series_matches_apply_on_typed_columns(values):
+    series = pd.Series(values)
+    pd.testing.assert_series_equal(normalize_series(series), series.apply(normalize_text).astype(object))
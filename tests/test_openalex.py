@@ -0,0 +1,77 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.openalex import OPENALEX_BATCH_SIZE, InstitutionCache, RetryableError, fetch_institutions
+
+class FakeFetcher:
+    # async stand-in for http_fetcher: records every batch it is asked for, answers every id except
+    # those in `unknown`, and raises RetryableError for the first `failures` calls
+    def __init__(self, unknown=(), failures=0):
+        self.batches = []
+        self.unknown = set(unknown)
+        self.failures = failures
+
+    async def __call__(self, ids):
+        self.batches.append(list(ids))
+        if self.failures:
+            self.failures -= 1
+            raise RetryableError("HTTP 429")
+        return [{"id": f"https://openalex.org/{id}", "display_name": f"institution {id}"} for id in ids if id not in self.unknown]
+
+def ids(count):
+    return [f"I{i}" for i in range(count)]
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = InstitutionCache(str(tmp_path / "openalex.sqlite"))
+    yield cache
+    cache.close()
+
+def test_ids_are_fetched_in_batches_of_100():
+    fetcher = FakeFetcher()
+    records = fetch_institutions(ids(250) + ["https://openalex.org/I0"], fetcher)
+    assert sorted(len(batch) for batch in fetcher.batches) == [50, OPENALEX_BATCH_SIZE, OPENALEX_BATCH_SIZE]
+    assert sorted(id for batch in fetcher.batches for id in batch) == sorted(ids(250))
+    assert list(records) == ids(250)
+    assert records["I7"]["display_name"] == "institution I7"
+
+def test_retryable_errors_are_retried():
+    fetcher = FakeFetcher(failures=2)
+    records = fetch_institutions(ids(3), fetcher, retries=2, backoff=0.)
+    assert len(fetcher.batches) == 3
+    assert all(record is not None for record in records.values())
+
+def test_retries_give_up_after_the_last_attempt():
+    fetcher = FakeFetcher(failures=3)
+    with pytest.raises(RetryableError):
+        fetch_institutions(ids(3), fetcher, retries=2, backoff=0.)
+
+def test_missing_ids_are_cached_as_null(cache):
+    fetcher = FakeFetcher(unknown={"I1"})
+    records = fetch_institutions(ids(3), fetcher, cache)
+    assert records["I1"] is None
+    assert cache.get(["I1"]) == {"I1": None}
+    assert cache.get(["I0"])["I0"]["display_name"] == "institution I0"
+
+def test_warm_cache_makes_no_fetcher_calls(cache):
+    first = fetch_institutions(ids(120), FakeFetcher(unknown={"I5"}), cache)
+    fetcher = FakeFetcher()
+    second = fetch_institutions(ids(120), fetcher, cache)
+    assert fetcher.batches == []
+    assert second == first
+
+def test_only_ids_missing_from_the_cache_are_fetched(cache):
+    fetch_institutions(ids(10), FakeFetcher(), cache)
+    fetcher = FakeFetcher()
+    fetch_institutions(ids(15), fetcher, cache)
+    assert fetcher.batches == [ids(15)[10:]]
+
+def test_expired_entries_are_fetched_again(tmp_path):
+    cache = InstitutionCache(str(tmp_path / "openalex.sqlite"), ttl=-1)
+    fetch_institutions(ids(2), FakeFetcher(), cache)
+    fetcher = FakeFetcher()
+    fetch_institutions(ids(2), fetcher, cache)
+    cache.close()
+    assert fetcher.batches == [ids(2)]
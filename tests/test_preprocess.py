@@ -0,0 +1,123 @@
+import importlib.util
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def preprocess(tmp_path, monkeypatch):
+    # pre-process.py reads processed/manual/fields_mapping.json at import and writes under processed/
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(repo_root)
+    os.makedirs("processed/manual")
+    os.makedirs("processed/by_year")
+    with open("processed/manual/fields_mapping.json", "w") as f:
+        json.dump({"1": ["ciencia da computacao", 10, "ciencias exatas"]}, f)
+    spec = importlib.util.spec_from_file_location("pre_process", os.path.join(repo_root, "pre-process.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# None, NaN and pd.NA, empty and "nan" strings, single and repeated characters, digit-only and
+# non-alphanumeric strings, non-strings and every literal of the invalid-pattern list, next to valid names
+edge_values = [
+    None, np.nan, pd.NA, "", "nan", "NaN",
+    "a", "Z", "7", "é", "-",
+    "aa", "zzzz", "11", "--", "  ", "aab",
+    "0", "123", "2004", "12a",
+    "invalid", "nao informado", "nao informada", "instituicao nao cadastrada", "nao consta", "outra", "outro", "ni",
+    "invalid2", "outras", "nao informado x", "ni ufmg",
+    5, 1.5,
+    "ufmg", "universidade de sao paulo", "mit", "puc-rio", "usp",
+]
+
+def test_valid_mask_matches_is_valid(preprocess):
+    series = pd.Series(edge_values * 2, index=np.arange(2 * len(edge_values))[::-1], dtype=object)
+    expected = series.map(preprocess.is_valid)
+    pd.testing.assert_series_equal(preprocess.valid_mask(series), expected, check_names=False)
+
+def test_remove_invalid_rows_matches_row_by_row(preprocess):
+    names, abbrs = np.meshgrid(np.arange(len(edge_values)), np.arange(len(edge_values)))
+    df = pd.DataFrame({
+        "degree_institution_name": pd.Series([edge_values[i] for i in names.ravel()], dtype=object),
+        "degree_institution_abbr": pd.Series([edge_values[i] for i in abbrs.ravel()], dtype=object),
+    })
+    expected = df[df.apply(lambda row: preprocess.is_valid(row["degree_institution_name"]) or preprocess.is_valid(row["degree_institution_abbr"]), axis=1)]
+    pd.testing.assert_frame_equal(preprocess.remove_invalid_rows(df), expected)
+
+def test_invalid_substitution_matches_map(preprocess):
+    column = pd.Series(edge_values, dtype=object)
+    expected = column.map(lambda x: "invalid" if not preprocess.is_valid(x) else x)
+    pd.testing.assert_series_equal(column.where(preprocess.valid_mask(column), "invalid"), expected)
+
+def capes_file(path, rows=40, seed=0, documents=None):
+    rng = np.random.default_rng(seed)
+    if documents is None:
+        documents = pd.array([None if i % 6 == 2 else int(rng.integers(1e10, 1e11)) for i in range(rows)], dtype="Int64")
+    # document numbers and years are missing in scattered rows, so some chunks have gaps and others do not
+    df = pd.DataFrame({
+        "AN_BASE": rng.choice([2013, 2014], rows),
+        "NM_ENTIDADE_ENSINO": rng.choice(["Universidade de Sao Paulo", "Unicamp", "nao informado"], rows),
+        "SG_ENTIDADE_ENSINO": rng.choice(["USP", "UNICAMP", "NI"], rows),
+        "NM_IES_TIT_MAX_DOCENTE": rng.choice(["Universidade Federal de Minas Gerais", "x", "Outra"], rows),
+        "SG_IES_TIT_MAX_DOCENTE": rng.choice(["UFMG", "MIT", "1"], rows),
+        "NM_PAIS_IES_TIT_MAX_DOCENTE": rng.choice(["BRASIL", "ESTADOS UNIDOS"], rows),
+        "AN_TITULACAO_DOCENTE": pd.array([None if i % 9 == 4 else int(rng.integers(1970, 2020)) for i in range(rows)], dtype="Int64"),
+        "DS_TITULACAO_ATUAL_DOCENTE": "DOUTORADO",
+        "ID_AREA_AVALIACAO": 1,
+        "CD_PROGRAMA_IES": "1001",
+        "NM_PROGRAMA_IES": "Ciencia da Computacao",
+        "NM_NIVEL_PROGRAMA": "MESTRADO/DOUTORADO",
+        "NM_MODALIDADE_PROGRAMA": "ACADÊMICO",
+        "NM_DOCENTE": [f"Professor {i % 15}" for i in range(rows)],
+        "AN_NASCIMENTO_DOCENTE": pd.array([None if i % 7 == 3 else int(rng.integers(1940, 1990)) for i in range(rows)], dtype="Int64"),
+        "DS_CATEGORIA_DOCENTE": "PERMANENTE",
+        "CD_CONCEITO_PROGRAMA": pd.array([None if i % 11 == 5 else int(rng.integers(3, 8)) for i in range(rows)], dtype="Int64"),
+        "NR_DOCUMENTO_DOCENTE": documents,
+        "TP_DOCUMENTO_DOCENTE": "CPF",
+    })
+    df.to_csv(path, sep=";", index=False, encoding="latin1")
+
+# numbers with gaps, numbers with leading zeros, and numbers with one text value in the last chunk
+document_columns = {
+    "gaps": None,
+    "leading_zeros": [f"0{i:010d}" if i % 6 else "" for i in range(40)],
+    "text": [str(10 ** 10 + i) for i in range(38)] + ["nao consta", ""],
+}
+
+@pytest.mark.parametrize("documents", list(document_columns))
+def test_chunked_run_matches_in_memory_run(preprocess, documents):
+    capes_file("capes.csv", documents=document_columns[documents])
+    df, summary = preprocess.process_data_file("capes.csv")
+    in_memory = df.to_csv(index=False, encoding="utf-8", sep=",")
+    by_year = {year: open(preprocess.by_year_path(year), encoding="utf-8").read() for year in summary["years"]}
+
+    _, chunked_summary = preprocess.process_data_file("capes.csv", chunksize=5)
+    part_dir = preprocess.part_directory("capes.csv")
+    assert chunked_summary == summary
+    assert open(f"{part_dir}/combined.csv", encoding="utf-8").read() == in_memory
+    for year, text in by_year.items():
+        assert open(f"{part_dir}/{year}.csv", encoding="utf-8").read() == text
+
+def test_in_memory_run_keeps_inferred_values(preprocess):
+    # digests and years are those of the values read_csv infers for the whole file ("123.0" for a
+    # numeric column with gaps), the same as before the chunked mode existed
+    capes_file("capes.csv")
+    raw = pd.read_csv("capes.csv", encoding="latin1", sep=";", low_memory=False)
+    df, _ = preprocess.process_data_file("capes.csv")
+    assert df["professor_document_number"].tolist() == [preprocess.anonymize_value(value) for value in raw.loc[df.index, "NR_DOCUMENTO_DOCENTE"]]
+    assert df["professor_birth_year"].dtype == float
+    assert df["professor_birth_year"].equals(raw.loc[df.index, "AN_NASCIMENTO_DOCENTE"].rename("professor_birth_year"))
+
+@pytest.mark.parametrize("infer_string", [False, True])
+def test_anonymize_series_matches_anonymize_value(preprocess, infer_string):
+    # future.infer_string is the pandas 3 default, where astype(str) leaves missing values missing
+    with pd.option_context("future.infer_string", infer_string):
+        series = pd.Series(["bob", np.nan, "alice", "bob", np.nan], index=[3, 1, 4, 1, 5], name="professor_name")
+        anonymized = preprocess.anonymize_series(series)
+    assert anonymized.tolist() == [preprocess.anonymize_value(value) for value in series]
+    assert anonymized.index.equals(series.index)
+    assert anonymized[5] != anonymized[3]
@@ -0,0 +1,38 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import springrank as sr
+
+def edge_sets(count, num_nodes=30, num_edges=120, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (rng.integers(0, num_nodes, num_edges), rng.integers(0, num_nodes, num_edges), rng.integers(1, 4, num_edges).astype(float))
+        for _ in range(count)
+    ]
+
+def test_batch_matches_springrank():
+    graphs = edge_sets(4)
+    reference = graphs[0]
+    ranks = list(sr.springrank_batch(graphs, 30, reference=reference))
+    for (sources, targets, weights), rank in zip(graphs, ranks):
+        np.testing.assert_allclose(rank, sr.springrank(sources, targets, weights, 30), atol=1e-6)
+
+def test_batch_skips_failed_solves(monkeypatch):
+    graphs = edge_sets(3)
+    solve = sr._solve
+    calls = iter([solve, None, solve])
+    def flaky_solve(*args):
+        step = next(calls)
+        if step is None:
+            raise RuntimeError("SpringRank solver did not converge")
+        return step(*args)
+    monkeypatch.setattr(sr, "_solve", flaky_solve)
+    ranks = list(sr.springrank_batch(graphs, 30, skip_failed=True))
+    assert ranks[1] is None and ranks[0] is not None and ranks[2] is not None
+
+    calls = iter([solve, None, solve])
+    with pytest.raises(RuntimeError):
+        list(sr.springrank_batch(graphs, 30))
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy import stats
+from utils.null_models import iteration_rng
+from utils.springrank import jacobi_preconditioner, laplacian_system, springrank
+
+# bootstrap of the SpringRank scores: every replicate redraws the observed hires with a multinomial over
+# the edges (probabilities proportional to the edge weights, same total number of hires) and ranks the
+# resampled graph warm-started from the observed scores
+
+def resample_weights(weights, rng, size=None):
+    weights = np.asarray(weights, dtype=float)
+    total = int(round(weights.sum()))
+    return rng.multinomial(total, weights / weights.sum(), size=size).astype(float)
+
+# read-only inputs of the replicates; set once per worker process by init_bootstrap_worker
+_bootstrap_inputs = {}
+
+def init_bootstrap_worker(sources, targets, weights, num_nodes, seed, springrank_params):
+    L = laplacian_system(sources, targets, weights, num_nodes, **springrank_params)[0]
+    _bootstrap_inputs.update(
+        sources=sources,
+        targets=targets,
+        weights=weights,
+        num_nodes=num_nodes,
+        seed=seed,
+        springrank_params=springrank_params,
+        observed=springrank(sources, targets, weights, num_nodes, **springrank_params),
+        preconditioner=jacobi_preconditioner(L),
+    )
+
+def bootstrap_scores(replicates):
+    inputs = _bootstrap_inputs
+    scores = np.empty((len(replicates), inputs["num_nodes"]))
+    for i, replicate in enumerate(replicates):
+        weights = resample_weights(inputs["weights"], iteration_rng(inputs["seed"], replicate))
+        scores[i] = springrank(
+            inputs["sources"], inputs["targets"], weights, inputs["num_nodes"],
+            x0=inputs["observed"], preconditioner=inputs["preconditioner"], **inputs["springrank_params"]
+        )
+    return scores
+
+def bootstrap_springrank(sources, targets, weights, num_nodes, num_replicates=1000, seed=42, jobs=1, chunk_size=50, springrank_params=None):
+    # (observed scores, (num_replicates, num_nodes) replicate scores); replicate r always draws from the
+    # r-th child of SeedSequence(seed), so the result does not depend on jobs or chunk_size
+    bootstrap_inputs = (sources, targets, weights, num_nodes, seed, springrank_params or {})
+    init_bootstrap_worker(*bootstrap_inputs)
+    chunks = [list(range(i, min(i + chunk_size, num_replicates))) for i in range(0, num_replicates, chunk_size)]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_bootstrap_worker, initargs=bootstrap_inputs) as executor:
+            scores = list(executor.map(bootstrap_scores, chunks))
+    else:
+        scores = [bootstrap_scores(chunk) for chunk in chunks]
+    return _bootstrap_inputs["observed"], np.concatenate(scores) if scores else np.empty((0, num_nodes))
+
+def rank_positions(scores):
+    # 1 is the highest score; ties share the best position
+    return stats.rankdata(-np.atleast_2d(scores), method="min", axis=1)
+
+def rank_quantiles(nodes, observed, scores, quantiles=(0.025, 0.5, 0.975)):
+    positions = rank_positions(scores)
+    df = pd.DataFrame({"score": observed, "rank": rank_positions(observed)[0]}, index=pd.Index(nodes, name="node"))
+    for q, values in zip(quantiles, np.quantile(scores, quantiles, axis=0)):
+        df[f"score_q{q:g}"] = values
+    for q, values in zip(quantiles, np.quantile(positions, quantiles, axis=0)):
+        df[f"rank_q{q:g}"] = values
+    df["rank_std"] = positions.std(axis=0)
+    return df
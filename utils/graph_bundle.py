@@ -0,0 +1,114 @@
+import json
+import os
+from collections import namedtuple
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# adjacency is a CSR matrix with one stored entry per MultiDiGraph edge (rows are degree institutions,
+# columns hiring institutions), so the edge_* arrays line up with adjacency.data
+GraphBundle = namedtuple("GraphBundle", ["adjacency", "nodes", "edge_field_id", "edge_big_field_id", "edge_base_year", "fields", "big_fields"])
+
+def _codes(values, vocabulary):
+    codes = pd.Series(values, dtype=object).map({value: code for code, value in enumerate(vocabulary)})
+    return codes.fillna(-1).to_numpy(dtype=np.int32)
+
+def factorize_endpoints(sources, targets):
+    # (source codes, target codes, nodes) with nodes numbered in order of first appearance, the same order
+    # networkx gives the nodes of a graph built from these edges
+    endpoints = np.empty(2 * len(sources), dtype=object)
+    endpoints[0::2] = np.asarray(sources, dtype=object)
+    endpoints[1::2] = np.asarray(targets, dtype=object)
+    codes, nodes = pd.factorize(endpoints)
+    return codes[0::2], codes[1::2], nodes
+
+def write_graph_bundle(path, edges, country_list, state_dict, region_dict):
+    sources, targets, names = factorize_endpoints(edges["degree_institution_abbr"], edges["institution_abbr"])
+    num_nodes = len(names)
+
+    order = np.lexsort((targets, sources))
+    # indptr and indices share the index dtype scipy would pick for them, so csr_matrix(copy=False)
+    # keeps both memory-mapped instead of casting them into memory
+    index_dtype = np.int32 if max(len(sources), num_nodes) <= np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(num_nodes + 1, dtype=index_dtype)
+    indptr[1:] = np.cumsum(np.bincount(sources, minlength=num_nodes))
+
+    states = sorted({state_dict[name] for name in names if name in state_dict and pd.notna(state_dict[name])})
+    regions = sorted({region_dict[name] for name in names if name in region_dict and pd.notna(region_dict[name])})
+    fields = edges.drop_duplicates("field_id").set_index("field_id")["field_name"]
+    big_fields = edges.drop_duplicates("big_field_id").set_index("big_field_id")["big_field_name"]
+
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        "indptr": indptr,
+        "indices": targets[order].astype(index_dtype),
+        "weights": edges["weight"].to_numpy(dtype=np.float64)[order],
+        "edge_field_id": edges["field_id"].to_numpy(dtype=np.int32)[order],
+        "edge_big_field_id": edges["big_field_id"].to_numpy(dtype=np.int32)[order],
+        "edge_base_year": edges["base_year"].to_numpy(dtype=np.int32)[order],
+        "node_state": _codes([state_dict.get(name) for name in names], states),
+        "node_region": _codes([region_dict.get(name) for name in names], regions),
+        "node_international": np.array([name in country_list for name in names], dtype=bool),
+    }
+    for name, values in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+    meta = {
+        "nodes": [str(name) for name in names],
+        "states": [str(state) for state in states],
+        "regions": [str(region) for region in regions],
+        "fields": {str(int(field_id)): str(name) for field_id, name in fields.items()},
+        "big_fields": {str(int(field_id)): str(name) for field_id, name in big_fields.items()},
+    }
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+def load_graph_bundle(path, mmap=True):
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in ["indptr", "indices", "weights", "edge_field_id", "edge_big_field_id", "edge_base_year", "node_state", "node_region", "node_international"]
+    }
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    num_nodes = len(meta["nodes"])
+    adjacency = sparse.csr_matrix((arrays["weights"], arrays["indices"], arrays["indptr"]), shape=(num_nodes, num_nodes), copy=False)
+    nodes = pd.DataFrame({
+        "name": meta["nodes"],
+        "state": pd.Categorical.from_codes(np.asarray(arrays["node_state"]), categories=meta["states"]),
+        "region": pd.Categorical.from_codes(np.asarray(arrays["node_region"]), categories=meta["regions"]),
+        "international": np.asarray(arrays["node_international"]),
+    })
+    return GraphBundle(
+        adjacency=adjacency,
+        nodes=nodes,
+        edge_field_id=arrays["edge_field_id"],
+        edge_big_field_id=arrays["edge_big_field_id"],
+        edge_base_year=arrays["edge_base_year"],
+        fields={int(k): v for k, v in meta["fields"].items()},
+        big_fields={int(k): v for k, v in meta["big_fields"].items()},
+    )
+
+def edge_arrays(G, nodelist=None, weight="weight"):
+    # (nodes, sources, targets, weights) of a networkx graph, with endpoints as positions in nodes;
+    # edges without the weight attribute count as 1, as in nx.to_scipy_sparse_array
+    nodes = list(G.nodes()) if nodelist is None else list(nodelist)
+    position = {node: i for i, node in enumerate(nodes)}
+    edges = list(G.edges(data=weight, default=1))
+    sources = np.fromiter((position[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+    targets = np.fromiter((position[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+    weights = np.fromiter((w for _, _, w in edges), dtype=float, count=len(edges))
+    return nodes, sources, targets, weights
+
+def load_edges(path):
+    # (nodes, sources, targets, weights) of a build-graphs.py bundle or GraphML file, or of a
+    # "source target weight" adjacency list
+    if path.endswith(".graphml"):
+        return edge_arrays(nx.read_graphml(path))
+    if path.rstrip("/").endswith(".bundle"):
+        bundle = load_graph_bundle(path)
+        A = bundle.adjacency
+        sources = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+        return bundle.nodes["name"].tolist(), sources, np.asarray(A.indices), np.asarray(A.data, dtype=float)
+    return edge_arrays(nx.read_weighted_edgelist(path, create_using=nx.DiGraph))
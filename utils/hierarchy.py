@@ -0,0 +1,31 @@
+import numpy as np
+from utils.graph_bundle import edge_arrays
+
+# hierarchy strength: the weighted fraction of edges u -> v with rank[u] < rank[v]; a graph without
+# edges has strength 0
+
+def hierarchy_strength(rank, sources, targets, weights):
+    rank, weights = np.asarray(rank), np.asarray(weights, dtype=float)
+    total = weights.sum()
+    if total == 0:
+        return 0
+    return weights[rank[sources] < rank[targets]].sum() / total
+
+def hierarchy_strength_batch(ranks, sources, targets, weights):
+    # ranks is (samples, nodes); sources, targets and weights are (samples, edges), or (edges,) when every
+    # sample has the same edges. Returns the (samples,) strengths
+    ranks = np.asarray(ranks)
+    shape = (ranks.shape[0], np.shape(weights)[-1])
+    sources, targets = np.broadcast_to(sources, shape), np.broadcast_to(targets, shape)
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), shape)
+    upward = np.take_along_axis(ranks, sources, axis=1) < np.take_along_axis(ranks, targets, axis=1)
+    totals = weights.sum(axis=1)
+    hierarchy = np.where(upward, weights, 0.).sum(axis=1)
+    return np.divide(hierarchy, totals, out=np.zeros(len(totals)), where=totals != 0)
+
+def graph_hierarchy_strength(G, rank):
+    # rank is a {node: rank} dict or an array in G.nodes() order
+    nodes, sources, targets, weights = edge_arrays(G)
+    if isinstance(rank, dict):
+        rank = np.array([rank[node] for node in nodes])
+    return hierarchy_strength(rank, sources, targets, weights)
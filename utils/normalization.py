@@ -1,13 +1,21 @@
+import numpy as np
 import pandas as pd
 import sys
 import unicodedata
 import re
+from functools import lru_cache
 
 _trans_table = dict.fromkeys(
     c for c in range(sys.maxunicode)
     if unicodedata.category(chr(c)) == 'Mn'
 )
 
+_disallowed_chars_regex = re.compile(r"[^-0-9a-z.\s]")
+_punctuation_regex = re.compile(r"[-.]")
+_whitespace_regex = re.compile(r"\s+")
+
+NORMALIZE_CACHE_SIZE = 2 ** 20
+
 def normalize_text(s: str) -> str:
     if not s:
         return ""
@@ -17,7 +25,39 @@ def normalize_text(s: str) -> str:
 
     s = str(s).lower()
     s = unicodedata.normalize("NFD", s).translate(_trans_table)
-    s = re.sub(r"[^-0-9a-z.\s]", " ", s)
-    s = re.sub(r"[-.]", "", s)
-    s = re.sub(r"\s+", " ", s)
+    s = _disallowed_chars_regex.sub(" ", s)
+    s = _punctuation_regex.sub("", s)
+    s = _whitespace_regex.sub(" ", s)
     return s.strip()
+
+# shared by every normalize_series call in the process, so values repeated across files are normalized once per run
+_normalize_text_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE, typed=True)(normalize_text)
+
+def _normalize_unique(value):
+    try:
+        return _normalize_text_cached(value)
+    except TypeError:
+        # unhashable values bypass the cache
+        return normalize_text(value)
+
+def normalize_series(series: pd.Series) -> pd.Series:
+    # same result as series.apply(normalize_text), but each distinct value is normalized only once
+    values = np.asarray(series, dtype=object)
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) not in ("string", "empty"):
+        # factorize folds values that compare equal (2 and 2.0, 1 and True) although their text
+        # differs, so mixed columns are factorized on (type, value)
+        keys = np.empty(len(values), dtype=object)
+        keys[:] = [(type(value), value) for value in values]
+        codes, uniques = pd.factorize(keys)
+        uniques = [value for _, value in uniques]
+    else:
+        codes, uniques = pd.factorize(series)
+    normalized = np.empty(len(uniques), dtype=object)
+    normalized[:] = [_normalize_unique(value) for value in uniques]
+    result = normalized[codes] if len(uniques) else np.empty(len(codes), dtype=object)
+
+    # factorize folds None and NaN together, but normalize_text maps them differently
+    missing = np.flatnonzero(codes == -1)
+    if len(missing):
+        result[missing] = [normalize_text(value) for value in values[missing]]
+    return pd.Series(result, index=series.index, name=series.name, dtype=object)
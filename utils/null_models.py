@@ -0,0 +1,18 @@
+import numpy as np
+
+def iteration_rng(seed, iteration):
+    # the generator of the iteration-th child of SeedSequence(seed), so a draw depends only on the seed
+    # and its iteration number, not on how many draws were made before it
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(iteration,)))
+
+def configuration_model_edges(out_degree, in_degree, weights, rng):
+    # directed configuration model by stub matching, as nx.directed_configuration_model (self-loops and
+    # parallel edges are kept): node i gets out_degree[i] out-stubs and in_degree[i] in-stubs, in-stubs are
+    # shuffled onto out-stubs, and the observed edge weights are shuffled onto the new edges
+    out_stubs = np.repeat(np.arange(len(out_degree)), out_degree)
+    in_stubs = np.repeat(np.arange(len(in_degree)), in_degree)
+    if len(out_stubs) != len(in_stubs):
+        raise ValueError(f"degree sequences must have the same sum ({len(out_stubs)} out, {len(in_stubs)} in)")
+    if len(weights) != len(out_stubs):
+        raise ValueError(f"expected {len(out_stubs)} weights, got {len(weights)}")
+    return out_stubs, rng.permutation(in_stubs), rng.permutation(np.asarray(weights, dtype=float))
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+OPENALEX_URL = "https://api.openalex.org"
+openalex_cache_path = "processed/openalex.sqlite"
+OPENALEX_CACHE_TTL = 30 * 24 * 60 * 60
+# OpenAlex accepts at most 100 ids in one openalex filter
+OPENALEX_BATCH_SIZE = 100
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class RetryableError(Exception):
+    pass
+
+def short_id(openalex_id):
+    # "https://openalex.org/I123" -> "I123"
+    return openalex_id.rsplit("/", 1)[-1]
+
+def http_fetcher(base_url=OPENALEX_URL, email="", timeout=30):
+    # a fetcher is an async callable taking a list of OpenAlex institution ids and returning their records;
+    # tests can pass a stub server's base_url here, or replace the fetcher with any such callable
+    def fetch(ids):
+        params = {"filter": "openalex:" + "|".join(ids), "per-page": len(ids)}
+        if email:
+            params["mailto"] = email
+        url = f"{base_url}/institutions?{urllib.parse.urlencode(params, safe=':|')}"
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return json.load(response)["results"]
+        except urllib.error.HTTPError as error:
+            if error.code in RETRY_STATUS:
+                raise RetryableError(f"HTTP {error.code}") from error
+            raise
+        except (urllib.error.URLError, TimeoutError) as error:
+            raise RetryableError(str(error)) from error
+
+    async def fetch_async(ids):
+        return await asyncio.to_thread(fetch, ids)
+    return fetch_async
+
+class InstitutionCache:
+    # OpenAlex records by short id, with the time they were fetched; ids OpenAlex did not return are stored
+    # with a null record, so a warm cache answers every id without a request
+    def __init__(self, path=openalex_cache_path, ttl=OPENALEX_CACHE_TTL):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS institutions (id TEXT PRIMARY KEY, record TEXT, fetched_at REAL)")
+        self.ttl = ttl
+
+    def get(self, ids):
+        oldest = time.time() - self.ttl
+        found = {}
+        for batch in chunks(list(ids), 500):
+            rows = self.connection.execute(
+                f"SELECT id, record FROM institutions WHERE fetched_at >= ? AND id IN ({','.join('?' * len(batch))})",
+                [oldest, *batch],
+            )
+            found.update((id, json.loads(record)) for id, record in rows)
+        return found
+
+    def put(self, records):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO institutions (id, record, fetched_at) VALUES (?, ?, ?)",
+                [(id, json.dumps(record), now) for id, record in records.items()],
+            )
+
+    def close(self):
+        self.connection.close()
+
+def chunks(lst, n):
+    for i in range(0, len(lst), n):
+        yield lst[i:i + n]
+
+async def _fetch_batch(fetcher, ids, cache, semaphore, retries, backoff):
+    async with semaphore:
+        for attempt in range(retries + 1):
+            try:
+                batch_records = await fetcher(ids)
+                break
+            except RetryableError:
+                if attempt == retries:
+                    raise
+                # exponential backoff with jitter, so throttled batches do not retry in lockstep
+                await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+    records = dict.fromkeys(ids)
+    records.update((short_id(record["id"]), record) for record in batch_records)
+    # every batch is cached as soon as it arrives, so a failed run keeps what it already fetched
+    if cache is not None:
+        cache.put(records)
+    return records
+
+async def fetch_institutions_async(ids, fetcher, cache=None, concurrency=8, retries=5, backoff=1., batch_size=OPENALEX_BATCH_SIZE):
+    ids = list(dict.fromkeys(short_id(id) for id in ids))
+    records = cache.get(ids) if cache is not None else {}
+    missing = [id for id in ids if id not in records]
+    semaphore = asyncio.Semaphore(concurrency)
+    for batch_records in await asyncio.gather(*(_fetch_batch(fetcher, batch, cache, semaphore, retries, backoff) for batch in chunks(missing, batch_size))):
+        records.update(batch_records)
+    return {id: records[id] for id in ids}
+
+def fetch_institutions(ids, fetcher=None, cache=None, **kwargs):
+    # {short id: OpenAlex record, or None when OpenAlex has no such institution}
+    return asyncio.run(fetch_institutions_async(ids, fetcher or http_fetcher(), cache, **kwargs))
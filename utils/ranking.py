@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import networkx as nx
+from scipy import sparse
+from utils.graph_bundle import GraphBundle, edge_arrays
+from utils.springrank import springrank
+
+ranking_cache_directory = "processed/rankings/cache"
+
+# every ranker takes the summed CSR adjacency of a graph (A[u, v] is the total weight of u -> v) and
+# returns one score per node, higher meaning higher in the hierarchy for SpringRank and minimum violation
+# ranking and more central for PageRank. New rankers only need to be added to RANKERS
+
+def springrank_scores(A, alpha=0., l0=1., l1=1.):
+    A = A.tocoo()
+    return springrank(A.row, A.col, A.data, A.shape[0], alpha=alpha, l0=l0, l1=l1, shift=False)
+
+def pagerank_scores(A, alpha=0.85, tol=1e-6, max_iter=100):
+    # same iteration as nx.pagerank: weighted out-edges, dangling nodes spread their rank uniformly
+    num_nodes = A.shape[0]
+    if num_nodes == 0:
+        return np.zeros(0)
+    out_strength = np.asarray(A.sum(axis=1)).ravel()
+    P = (sparse.diags(np.divide(1., out_strength, out=np.zeros(num_nodes), where=out_strength != 0)) @ A).T.tocsr()
+    dangling = out_strength == 0
+    x = np.full(num_nodes, 1. / num_nodes)
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (P @ x_last + x_last[dangling].sum() / num_nodes) + (1 - alpha) / num_nodes
+        if np.abs(x - x_last).sum() < num_nodes * tol:
+            return x
+    raise RuntimeError(f"PageRank did not converge in {max_iter} iterations")
+
+def _incident_violations(A, AT, position, node, exclude=-1):
+    # weight of the violated edges at node: u -> v is violated when v is placed above u
+    out_nodes, out_weights = A.indices[A.indptr[node]:A.indptr[node + 1]], A.data[A.indptr[node]:A.indptr[node + 1]]
+    in_nodes, in_weights = AT.indices[AT.indptr[node]:AT.indptr[node + 1]], AT.data[AT.indptr[node]:AT.indptr[node + 1]]
+    return (
+        out_weights[(position[out_nodes] > position[node]) & (out_nodes != exclude)].sum() +
+        in_weights[(position[in_nodes] < position[node]) & (in_nodes != exclude)].sum()
+    )
+
+def minimum_violation_scores(A, steps=None, temperature=(1., 1e-3), initial=None, seed=0):
+    # minimum violation ranking: the order of the nodes with the least total weight on edges that point up
+    # the order, searched by simulated annealing over swaps of two nodes, starting from the SpringRank
+    # order. Returns each node's position in the best order found (0 is the bottom)
+    num_nodes = A.shape[0]
+    if num_nodes < 2:
+        return np.zeros(num_nodes)
+    A = A.tocsr()
+    AT = A.T.tocsr()
+    if initial is None:
+        initial = springrank_scores(A)
+    position = np.empty(num_nodes, dtype=np.int64)
+    position[np.argsort(initial, kind="stable")] = np.arange(num_nodes)
+
+    steps = 200 * num_nodes if steps is None else steps
+    scale = A.data.mean() if A.nnz else 1.
+    temperatures = scale * temperature[0] * (temperature[1] / temperature[0]) ** (np.arange(steps) / steps)
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(num_nodes, size=(steps, 2))
+    uniforms = rng.random(steps)
+
+    violations = best_violations = 0.
+    best_position = position.copy()
+    for step, (a, b) in enumerate(pairs):
+        if a == b:
+            continue
+        before = _incident_violations(A, AT, position, a, exclude=b) + _incident_violations(A, AT, position, b)
+        position[a], position[b] = position[b], position[a]
+        delta = _incident_violations(A, AT, position, a, exclude=b) + _incident_violations(A, AT, position, b) - before
+        if delta <= 0 or uniforms[step] < np.exp(-delta / temperatures[step]):
+            violations += delta
+            if violations < best_violations:
+                best_violations = violations
+                best_position = position.copy()
+        else:
+            position[a], position[b] = position[b], position[a]
+    return best_position.astype(float)
+
+RANKERS = {
+    "springrank": springrank_scores,
+    "pagerank": pagerank_scores,
+    "mvr": minimum_violation_scores,
+}
+
+def graph_adjacency(graph):
+    # (nodes, summed CSR adjacency) of a networkx graph, a GraphBundle or a (nodes, sources, targets,
+    # weights) tuple; parallel edges are summed and the indices sorted, so equal graphs give equal arrays
+    if isinstance(graph, GraphBundle):
+        nodes = graph.nodes["name"].tolist()
+        A = sparse.csr_matrix(graph.adjacency, dtype=float, copy=True)
+    else:
+        nodes, sources, targets, weights = edge_arrays(graph) if isinstance(graph, nx.Graph) else graph
+        A = sparse.csr_matrix((np.asarray(weights, dtype=float), (sources, targets)), shape=(len(nodes), len(nodes)))
+    A.sum_duplicates()
+    A.sort_indices()
+    return list(nodes), A
+
+def graph_hash(nodes, A):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(node) for node in nodes]).encode("utf-8"))
+    for values in [A.indptr.astype(np.int64), A.indices.astype(np.int64), A.data.astype(np.float64)]:
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+def _cache_path(cache_directory, name, key, params):
+    params_key = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_directory, f"{name}-{key}-{params_key}.npy")
+
+def rank_graph(graph, rankers=tuple(RANKERS), params=None, cache_directory=ranking_cache_directory):
+    # one column per ranker, indexed by node. Scores are memoized on disk by graph content and ranker
+    # parameters, so unchanged graphs are not ranked again; cache_directory=None disables the cache
+    params = params or {}
+    nodes, A = graph_adjacency(graph)
+    key = graph_hash(nodes, A)
+    scores = {}
+    for name in rankers:
+        path = None if cache_directory is None else _cache_path(cache_directory, name, key, params.get(name, {}))
+        if path is not None and os.path.exists(path):
+            scores[name] = np.load(path)
+            continue
+        scores[name] = RANKERS[name](A, **params.get(name, {}))
+        if path is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            np.save(path, scores[name])
+    return pd.DataFrame(scores, index=pd.Index(nodes, name="node"))
@@ -0,0 +1,40 @@
+from scipy import stats
+
+# sequential Monte Carlo stopping rules for a p-value estimated as extremes / draws, where extremes is the
+# number of null draws at least as extreme as the observed statistic. A rule is called with the running
+# (extremes, draws) and returns True once sampling can stop
+
+STOPPING_RULES = ["fixed", "besag-clifford", "confidence"]
+
+def clopper_pearson(extremes, draws, confidence=0.99):
+    # exact binomial interval of the p-value
+    if draws == 0:
+        return 0., 1.
+    tail = (1 - confidence) / 2
+    lower = stats.beta.ppf(tail, extremes, draws - extremes + 1) if extremes > 0 else 0.
+    upper = stats.beta.ppf(1 - tail, extremes + 1, draws - extremes) if extremes < draws else 1.
+    return float(lower), float(upper)
+
+def besag_clifford_rule(extremes_needed):
+    # Besag & Clifford (1991): stop after extremes_needed extreme draws, so a large p-value is settled after
+    # a few draws and only small p-values use the whole budget
+    def rule(extremes, draws):
+        return extremes >= extremes_needed
+    return rule
+
+def confidence_rule(threshold=0.05, confidence=0.99, precision=None):
+    # stop once the Clopper-Pearson interval lies entirely on one side of threshold, or is at most
+    # precision wide
+    def rule(extremes, draws):
+        lower, upper = clopper_pearson(extremes, draws, confidence)
+        return upper < threshold or lower > threshold or (precision is not None and upper - lower <= precision)
+    return rule
+
+def stopping_rule(name, extremes_needed=10, threshold=0.05, confidence=0.99, precision=None):
+    if name == "fixed":
+        return None
+    if name == "besag-clifford":
+        return besag_clifford_rule(extremes_needed)
+    if name == "confidence":
+        return confidence_rule(threshold, confidence, precision)
+    raise ValueError(f"unknown stopping rule: {name}")
@@ -0,0 +1,70 @@
+import pandas as pd
+
+TABLE_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+# repeated string columns that are dictionary-encoded in the columnar formats
+CATEGORICAL_COLUMNS = [
+    "institution_name",
+    "institution_abbr",
+    "institution_canonical_name",
+    "institution_state",
+    "institution_region",
+    "degree_institution_name",
+    "degree_institution_abbr",
+    "degree_institution_canonical_name",
+    "degree_institution_state",
+    "degree_institution_region",
+    "degree_institution_country",
+    "program_id",
+    "program_name",
+    "program_capes_score",
+    "field_name",
+    "big_field_name",
+    "employee_type",
+    "professor_document_type",
+]
+
+def add_format_arguments(parser, writes_output=True):
+    parser.add_argument("--format", choices=list(TABLE_FORMATS), default="csv", help="format of the intermediate tables read and written by this stage (default: csv)")
+    if writes_output:
+        parser.add_argument("--export-csv", action="store_true", help="also write the output table as CSV when --format is columnar")
+
+def table_path(stem, table_format="csv"):
+    return stem + TABLE_FORMATS[table_format]
+
+def _to_columnar(df):
+    df = df.reset_index(drop=True)
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        # pd.NA and NaN are written as nulls, the same as an empty CSV cell
+        df[column] = df[column].where(df[column].notna(), None)
+        # arrow needs one type per column; mixed columns are stored as the strings a CSV round trip would give
+        values = df[column].dropna()
+        if not values.map(lambda x: isinstance(x, str)).all():
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    return df
+
+def write_table(df, stem, table_format="csv", export_csv=False):
+    if table_format == "csv" or export_csv:
+        df.to_csv(table_path(stem, "csv"), index=False, encoding="utf-8", sep=",")
+    if table_format == "parquet":
+        _to_columnar(df).to_parquet(table_path(stem, "parquet"), index=False)
+    elif table_format == "feather":
+        _to_columnar(df).to_feather(table_path(stem, "feather"))
+
+def read_table(stem, table_format="csv", columns=None):
+    path = table_path(stem, table_format)
+    if table_format == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    if table_format == "feather":
+        return pd.read_feather(path, columns=columns)
+    df = pd.read_csv(path, sep=",", low_memory=False, encoding="utf-8", usecols=columns)
+    return df if columns is None else df[columns]